@@ -1,5 +1,6 @@
 from scipy.stats import bernoulli
 import pytest
+import probtest
 
 def throw_die():
     """Throws a fair die by calling the recursive state function, 
@@ -45,10 +46,12 @@ def state(X, i):
         else: return 6
 
 @pytest.fixture()
+@probtest.shared_sample
 def o():
     return throw_die()
 
-def test_Q1_between1and6(o):
+def test_Q1_between1and6(o, probtest_outcome):
+    probtest_outcome(o)
     assert o>=1 and o<=6
 
 def test_Q2_even_outcome(o):
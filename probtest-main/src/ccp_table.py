@@ -0,0 +1,107 @@
+"""
+Lookup of the upper bound k computed by ccp_upper_bound without solving
+the coupon collector's problem, and thus without importing numpy.
+
+Specifications are identified by a canonical key built from epsilon and 
+the sorted distinct probabilities with their multiplicities, so that e.g.
+--p 0.5,0.5, --minp 0.5 --N 2 and --Pbug 0.5 share a key. TABLE contains
+precomputed values of k for common choices of epsilon and Pbug, and is
+regenerated by running this script:
+    python ccp_table.py
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+from collections import Counter
+
+def group(P):
+    """Returns the distinct probabilities of P and their multiplicities
+    as two lists sorted by probability."""
+
+    groups = sorted(Counter(float(p) for p in P).items())
+    return [p for p, _ in groups], [c for _, c in groups]
+
+def spec_key(epsilon,P,counts):
+    """Returns the canonical key of the specification where the 
+    probability P[i] is shared by counts[i] outcomes."""
+
+    groups = Counter()
+    for p, c in zip(P, counts):
+        groups[float(p)] += int(c)
+    return repr(float(epsilon))+":"+",".join(
+        repr(p)+"x"+str(c) for p, c in sorted(groups.items()))
+
+def lookup(epsilon,P,counts):
+    """Returns the precomputed k of the specification, or None if it is 
+    not in TABLE."""
+
+    return TABLE.get(spec_key(epsilon,P,counts))
+
+# Epsilons and bug probabilities that TABLE is precomputed for.
+EPSILONS = [0.1, 0.05, 0.01, 0.005, 0.001]
+PBUGS = [0.5, 0.25, 0.2, 0.1, 0.05, 0.01, 0.005, 0.001, 0.0001]
+
+def precompute():
+    """Computes k for all combinations of EPSILONS and PBUGS."""
+
+    import ccp_upper_bound
+    table = {}
+    for epsilon in EPSILONS:
+        for Pbug in PBUGS:
+            P, counts = group([Pbug, 1-Pbug])
+            table[spec_key(epsilon,P,counts)] = ccp_upper_bound.ccp_grouped(epsilon,P,counts)
+    return table
+
+TABLE = {
+    '0.1:0.5x2': 5,
+    '0.1:0.25x1,0.75x1': 9,
+    '0.1:0.2x1,0.8x1': 11,
+    '0.1:0.1x1,0.9x1': 22,
+    '0.1:0.05x1,0.95x1': 45,
+    '0.1:0.01x1,0.99x1': 230,
+    '0.1:0.005x1,0.995x1': 460,
+    '0.1:0.001x1,0.999x1': 2302,
+    '0.1:0.0001x1,0.9999x1': 23025,
+    '0.05:0.5x2': 6,
+    '0.05:0.25x1,0.75x1': 11,
+    '0.05:0.2x1,0.8x1': 14,
+    '0.05:0.1x1,0.9x1': 29,
+    '0.05:0.05x1,0.95x1': 59,
+    '0.05:0.01x1,0.99x1': 299,
+    '0.05:0.005x1,0.995x1': 598,
+    '0.05:0.001x1,0.999x1': 2995,
+    '0.05:0.0001x1,0.9999x1': 29956,
+    '0.01:0.5x2': 8,
+    '0.01:0.25x1,0.75x1': 17,
+    '0.01:0.2x1,0.8x1': 21,
+    '0.01:0.1x1,0.9x1': 44,
+    '0.01:0.05x1,0.95x1': 90,
+    '0.01:0.01x1,0.99x1': 459,
+    '0.01:0.005x1,0.995x1': 919,
+    '0.01:0.001x1,0.999x1': 4603,
+    '0.01:0.0001x1,0.9999x1': 46050,
+    '0.005:0.5x2': 9,
+    '0.005:0.25x1,0.75x1': 19,
+    '0.005:0.2x1,0.8x1': 24,
+    '0.005:0.1x1,0.9x1': 51,
+    '0.005:0.05x1,0.95x1': 104,
+    '0.005:0.01x1,0.99x1': 528,
+    '0.005:0.005x1,0.995x1': 1058,
+    '0.005:0.001x1,0.999x1': 5296,
+    '0.005:0.0001x1,0.9999x1': 52981,
+    '0.001:0.5x2': 11,
+    '0.001:0.25x1,0.75x1': 25,
+    '0.001:0.2x1,0.8x1': 31,
+    '0.001:0.1x1,0.9x1': 66,
+    '0.001:0.05x1,0.95x1': 135,
+    '0.001:0.01x1,0.99x1': 688,
+    '0.001:0.005x1,0.995x1': 1379,
+    '0.001:0.001x1,0.999x1': 6905,
+    '0.001:0.0001x1,0.9999x1': 69075,
+}
+
+if __name__ == "__main__":
+    print("TABLE = {")
+    for key, k in precompute().items():
+        print("    "+repr(key)+": "+str(k)+",")
+    print("}")
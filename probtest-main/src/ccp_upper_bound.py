@@ -3,7 +3,9 @@ Determines an upper bound on the number of times to run a probabilistic program
 to be sure with 1-epsilon to have covered all outputs of the program.
 
 Contains the method ccp(epsilon,N,P) which takes as parameters an epsilon, 
-the number of possible outputs, and a list P of probabilities of the outcome.
+the number of possible outputs, and a list P of probabilities of the outcome,
+and the method ccp_grouped(epsilon,P,counts) for output sets where many 
+outcomes share the same probability.
 
 The python script can be run with parameters as shown below.
 Benchmarking is also included, but must be uncommented to run.
@@ -16,10 +18,14 @@ Author: Katrine Christensen <katch@itu.dk>
 """
 
 import sys
-import numpy as np
-from functools import reduce
-from decimal import Decimal
-import matplotlib.pyplot as plt
+import math
+
+# numpy is imported in the functions that use it rather than here, as this
+# module is imported by the probtest plugin, and importing numpy would
+# otherwise slow down every pytest session.
+
+# Upper limit on the number of runs searched for before giving up.
+MAX_K = 2**62
 
 def ccp(epsilon,N,P):
     """Returns an upper bound on number of times to run a probabilistic 
@@ -40,28 +46,166 @@ def ccp(epsilon,N,P):
         ValueError: When N and P is not of the same length.
         ValueError: When N<=1.
         ValueError: When the probabilities do not sum to ≤1.
+        ValueError: When a probability is smaller than or equal to 0.
 
     Returns:
         Upper bound on the number of times to run the probabilistic program.
     """
 
-    if N>1 and epsilon<=0:
-        raise ValueError("epsilon must be greater than 0")
     if N!=len(P):
         raise ValueError("N and P must be of same length")
+
+    import numpy as np
+
+    # Equal probabilities are grouped so that each distinct probability is
+    # only raised to the power k once.
+    P, counts = np.unique(np.asarray(P, dtype=float), return_counts=True)
+    return ccp_grouped(epsilon,P,counts)
+
+def ccp_grouped(epsilon,P,counts):
+    """Returns the same upper bound as ccp for the output set where the 
+    probability P[i] is shared by counts[i] outcomes, e.g. the fair die 
+    is given by P=[1/6] and counts=[6].
+
+    The probability that more than k runs are needed is evaluated as the
+    sum of counts[i]*(1-P[i])**k, so the cost of each evaluation depends
+    on the number of distinct probabilities and not on N=sum(counts). The
+    sum is computed in log space, and k is solved in closed form when all
+    outcomes have the same probability and by bisection otherwise.
+
+    Args:
+        epsilon: The specification of how sure we want to be that we have
+        achieved coverage.
+        P: A list of distinct probabilities of the outcomes.
+        counts: A list of the number of outcomes having each probability.
+
+    Raises:
+        ValueError: When epsilon is smaller than or equal to 0 for a 
+        nondeterministic program.
+        ValueError: When P and counts is not of the same length.
+        ValueError: When N<=1.
+        ValueError: When the probabilities do not sum to ≤1.
+        ValueError: When a probability is smaller than or equal to 0.
+
+    Returns:
+        Upper bound on the number of times to run the probabilistic program.
+    """
+
+    import numpy as np
+
+    P = np.asarray(P, dtype=float)
+    counts = np.asarray(counts, dtype=np.int64)
+    N = int(np.sum(counts))
+
+    if len(P)!=len(counts):
+        raise ValueError("P and counts must be of same length")
     if N<1:
         raise ValueError("N must be larger than or equal to 1.")
-    if reduce(lambda a, b: Decimal(a)+Decimal(b), P) > 1+1E-3:
+    if epsilon<=0 and np.any(P<1):
+        raise ValueError("epsilon must be greater than 0")
+    if math.fsum(P*counts) > 1+1E-3:
         raise ValueError("Probabilities must sum to ≤ 1")
-    
-    k = N
-    sum = epsilon
-    while sum>=epsilon:
-        sum = 0
-        for i in range(0,N):
-            sum += (1-P[i])**k
-        k +=1
-    return k-1  
+    if np.any(P<=0):
+        raise ValueError("Probabilities must be greater than 0")
+
+    # The tail is evaluated in log space, where the term counts[i]*(1-P[i])**k
+    # becomes log(counts[i]) + k*log1p(-P[i]). This neither underflows for
+    # large k nor loses the precision of 1-P[i] when P[i] is tiny.
+    with np.errstate(divide='ignore'):
+        log_q = np.log1p(-P)
+    log_counts = np.log(counts)
+    log_epsilon = math.log(epsilon) if epsilon>0 else -math.inf
+
+    def covered(k):
+        return logsumexp(log_counts + k*log_q) < log_epsilon
+
+    # The least likely outcome dominates the tail. Its term alone gives a 
+    # lower bound on k, and giving all N outcomes its probability gives an
+    # upper bound. Both are solved in closed form, and they coincide when
+    # all outcomes have the same probability.
+    i = np.argmax(log_q)
+    if log_q[i]==-math.inf:
+        # The program is deterministic, P=[1].
+        return N
+    lo = max(N, closed_form_k(log_epsilon-log_counts[i], log_q[i])-1)
+    hi = max(N, closed_form_k(log_epsilon-math.log(N), log_q[i])+1)
+
+    # Rounding may move the closed form bounds by one, in which case the 
+    # search falls back to bracketing.
+    if lo>N and covered(lo):
+        return smallest_k(covered, N)
+    if not covered(hi):
+        return smallest_k(covered, hi)
+    if lo==N and covered(lo):
+        return N
+    return bisect_k(covered, lo, hi)
+
+def closed_form_k(log_bound, log_q):
+    """Returns the smallest k for which k*log_q < log_bound, i.e., for 
+    which q**k < exp(log_bound), where log_q < 0.
+
+    Raises:
+        ValueError: When k is larger than MAX_K.
+    """
+
+    x = log_bound/log_q
+    if x >= MAX_K:
+        raise ValueError("No number of runs achieves coverage with the given epsilon")
+    return math.floor(x)+1
+
+def logsumexp(a):
+    """Returns log(sum(exp(a))) without underflowing when all elements of
+    a are very negative."""
+
+    import numpy as np
+
+    m = np.max(a)
+    if m==-math.inf:
+        return m
+    return m + math.log(np.sum(np.exp(a-m)))
+
+def smallest_k(covered, k_min):
+    """Returns the smallest k >= k_min for which covered(k) holds.
+
+    The probability of not having achieved coverage after k runs is
+    non-increasing in k, so covered is monotone. The answer is first 
+    bracketed by doubling k and then found by bisection, which needs
+    O(log k) evaluations of covered instead of one per k.
+
+    Args:
+        covered: Monotone predicate on the number of runs k.
+        k_min: The smallest number of runs to consider.
+
+    Raises:
+        ValueError: When no number of runs below MAX_K satisfies covered.
+
+    Returns:
+        The smallest number of runs k >= k_min satisfying covered.
+    """
+
+    if covered(k_min):
+        return k_min
+
+    # Exponential bracketing: covered(lo) is false and covered(hi) is true.
+    lo, hi = k_min, 2*k_min
+    while not covered(hi):
+        if hi >= MAX_K:
+            raise ValueError("No number of runs achieves coverage with the given epsilon")
+        lo, hi = hi, 2*hi
+    return bisect_k(covered, lo, hi)
+
+def bisect_k(covered, lo, hi):
+    """Returns the smallest k in (lo, hi] for which the monotone predicate
+    covered holds, given that covered(lo) is false and covered(hi) is true.
+    """
+
+    while hi-lo > 1:
+        mid = (lo+hi)//2
+        if covered(mid):
+            hi = mid
+        else:
+            lo = mid
+    return hi
 
 def main():
     """Runs the method for determining an upper bound on number of times to run
@@ -77,6 +221,8 @@ def main():
         raise ValueError("Must provide at least three arguments:"+
                          "an epsilon, the size of the output set and a vector of probabilities")
 
+    import numpy as np
+
     epsilon = float(sys.argv[1])
     N = int(sys.argv[2])
 
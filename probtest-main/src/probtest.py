@@ -2,19 +2,127 @@
 
 Given a specification of the program under test, automatically computes
 the number to run the tests. According to this number, creates a number
-of identical copies (subtests) of each test with dependencies between the 
-subtests using the pytest-dependency library.
+of identical copies (subtests) of each test. When a subtest fails, the 
+remaining subtests of the same test are skipped. Alternatively, with 
+--probtest-single-item, each test is collected once and the plugin runs
+it repeatedly in pytest_runtest_protocol.
 
 Author: Katrine Christensen <katch@itu.dk>
 """
 
+import inspect
+import os
 import pytest
 import re
+import secrets
 import sys
+import time
 from pathlib import Path
 sys.path.insert(1, './src')
-import ccp_upper_bound
+import ccp_table
+import probtest_random
 from pytest import Config
+from _pytest.runner import runtestprotocol
+
+# Key of the k values computed in previous sessions in .pytest_cache
+K_CACHE_KEY = "probtest/k"
+
+# The seeds of failing repeats, stored in .pytest_cache for each test
+SEEDS_CACHE_KEY = "probtest/failed_seeds"
+MAX_FAILED_SEEDS = 16
+
+# The index of the repeat of a test that is currently being run
+repeat_key = pytest.StashKey[int]()
+
+# For each original test whose remaining repeats are skipped, the reason
+stopped_key = pytest.StashKey[dict]()
+
+# Detects whether the first repeat of a test draws any randomness
+probe_key = pytest.StashKey[object]()
+
+# The number of times to run a test
+k_key = pytest.StashKey[int]()
+
+# The number of outcomes of a test
+n_key = pytest.StashKey[int]()
+
+# For each original test, the outcomes recorded with probtest_outcome
+outcomes_key = pytest.StashKey[dict]()
+
+# The tests that stopped before running k times without failing, as 
+# tuples of their node id, the reason, the runs and k
+saved_key = pytest.StashKey[list]()
+
+# The values of k computed in this session, keyed by their specification
+specs_key = pytest.StashKey[dict]()
+
+# The number of samples drawn by each call of a batch test
+batch_key = pytest.StashKey[int]()
+
+# The index of the failing sample found by the last call of a batch test
+sample_key = pytest.StashKey[int]()
+
+# The seed of the repeat of a test that is currently being run
+seed_key = pytest.StashKey[int]()
+
+# The base seed of the session, from which the seed of each repeat is derived
+base_seed_key = pytest.StashKey[int]()
+
+# For each original node id, the seeds of repeats that failed in earlier
+# sessions, which are used for the first repeats of the test
+failed_seeds_key = pytest.StashKey[dict]()
+
+# For each original node id run in this session, the seed of its failing
+# repeat, or None if it passed
+results_key = pytest.StashKey[dict]()
+
+# For each node id, the fingerprint of the test and its number of passing
+# repeats accumulated over sessions with --probtest-incremental
+certified_key = pytest.StashKey[dict]()
+
+# The number of passing repeats of a test accumulated in earlier sessions
+resume_key = pytest.StashKey[int]()
+
+# The fingerprint of a test certified with --probtest-incremental
+fingerprint_key = pytest.StashKey[str]()
+
+# The tests that have not yet passed all their repeats with 
+# --probtest-incremental, as tuples of their node id, passes and repeats
+partial_key = pytest.StashKey[list]()
+
+# The durations of the repeats of a test run with --probtest-aggregate
+durations_key = pytest.StashKey[object]()
+
+# The summaries of the tests run with --probtest-aggregate
+summaries_key = pytest.StashKey[list]()
+
+# The values of shared sample fixtures, keyed by the fixture and the repeat
+samples_key = pytest.StashKey[dict]()
+
+# The node id and repeat index given with --probtest-replay
+replay_key = pytest.StashKey[tuple]()
+
+# The number of repeats of a test whose test function is called 
+# concurrently, replaced by the number of repeats run once it has been called
+concurrent_key = pytest.StashKey[int]()
+
+# The sequential probability ratio test given with --probtest-sprt
+sprt_key = pytest.StashKey[object]()
+
+# The log-likelihood ratio of the repeats of a test run with --probtest-sprt
+walk_key = pytest.StashKey[object]()
+
+# The distinct probabilities of the outcomes given on the command line, 
+# with their multiplicities
+command_line_spec_key = pytest.StashKey[tuple]()
+
+# The cost of a repeat of each test in seconds, keyed by node id, measured
+# in this and earlier sessions with --probtest-global-epsilon
+costs_key = pytest.StashKey[dict]()
+
+# The tests given a share of --probtest-global-epsilon, as tuples of their
+# node id, the cost of a repeat, their epsilon and k
+allocation_key = pytest.StashKey[list]()
 
 def pytest_addoption(parser):
     """Adds pytest options to pytest. Enables us to write for example
@@ -59,21 +167,296 @@ def pytest_addoption(parser):
         type=float,
         help="Specify the probability of a bug occurring")
 
+    group.addoption(
+        "--probtest-sprt",
+        action="store",
+        default=None,
+        metavar="P0,P1,ALPHA,BETA",
+        help="Decide between P(bug) <= P0 and P(bug) >= P1, where a failing repeat "
+        "is a bug, with Wald's sequential probability ratio test with error "
+        "probabilities ALPHA and BETA, stopping a test as soon as it is decided. "
+        "Implies --probtest-single-item and --Pbug P1 if no specification is given")
+
+    group.addoption(
+        "--probtest-global-epsilon",
+        action="store",
+        type=float,
+        default=None,
+        metavar="E",
+        help="Bound the probability that any test misses an outcome by E, split "
+        "over the tests so that the total time of their repeats, measured in "
+        "earlier sessions, is minimal. Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-single-item",
+        action="store_true",
+        help="Collect each test once and repeat it k times when it is run, "
+        "instead of collecting k copies of each test")
+
+    group.addoption(
+        "--probtest-workers",
+        action="store",
+        type=int,
+        default=0,
+        help="Run the repeats of each test in parallel in a pool of this many "
+        "worker processes. Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-recycle-repeats",
+        action="store",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Replace a worker of --probtest-workers by a new process forked "
+        "from the pytest process before it would run more than N repeats, "
+        "so that state leaked by repeats does not reach later repeats")
+
+    group.addoption(
+        "--probtest-recycle-memory",
+        action="store",
+        type=float,
+        default=0,
+        metavar="MIB",
+        help="Replace a worker of --probtest-workers by a new process forked "
+        "from the pytest process once its peak memory has grown by MIB MiB")
+
+    group.addoption(
+        "--probtest-preload",
+        action="store",
+        default=None,
+        metavar="MODULES",
+        help="Import these modules, separated by commas, into the pytest process "
+        "before the workers of --probtest-workers are forked from it")
+
+    group.addoption(
+        "--probtest-threads",
+        action="store",
+        type=int,
+        default=0,
+        help="Run the repeats of tests marked probtest_thread_safe concurrently "
+        "in a pool of this many threads. Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-async-concurrency",
+        action="store",
+        type=int,
+        default=0,
+        help="Run up to this many repeats of async tests concurrently on one "
+        "event loop. Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-fork",
+        action="store",
+        nargs="?",
+        type=int,
+        const=1,
+        default=0,
+        metavar="BATCH",
+        help="Set up the fixtures of each test once and run each batch of BATCH "
+        "repeats (1 by default) in a child process forked from that state, so "
+        "that the repeats cannot change the state of each other or of the "
+        "session. Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-batch-size",
+        action="store",
+        type=int,
+        default=1000,
+        help="The number of samples drawn by each call of a test marked "
+        "probtest_batch without a size")
+
+    group.addoption(
+        "--probtest-seed",
+        action="store",
+        type=int,
+        default=None,
+        help="The base seed from which the seed of each repeat of each test "
+        "is derived. By default, a random base seed is drawn and reported")
+
+    group.addoption(
+        "--probtest-replay",
+        action="store",
+        default=None,
+        metavar="NODEID@INDEX",
+        help="Run only the repeat INDEX of the test NODEID, e.g. "
+        "test_die.py::test_f@17, with the seed it had in the session with the "
+        "same --probtest-seed. Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-incremental",
+        action="store_true",
+        help="Accumulate the passing repeats of each test over sessions in "
+        ".pytest_cache, skipping tests that have passed k repeats since their "
+        "source or specification last changed, and resuming the others. "
+        "Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-budget",
+        action="store",
+        type=int,
+        default=None,
+        help="Run at most this many repeats of each test in this session. "
+        "Implies --probtest-incremental")
+
+    group.addoption(
+        "--probtest-aggregate",
+        action="store_true",
+        help="Fold the repeats of each test into one summary of their number, "
+        "first failure and durations, printed at the end of the session. "
+        "Implies --probtest-single-item")
+
+    group.addoption(
+        "--probtest-profile",
+        action="store_true",
+        help="Record the wall time, CPU time and peak memory of the setup, call "
+        "and teardown of each repeat, write them to --probtest-profile-path and "
+        "list the slowest tests")
+
+    group.addoption(
+        "--probtest-profile-path",
+        action="store",
+        default=None,
+        metavar="PATH",
+        help="Write the profile to PATH, as JSON, or NPZ if PATH ends with .npz "
+        "(.pytest_cache/d/probtest/profile.json by default). Implies --probtest-profile")
+
+    group.addoption(
+        "--probtest-cprofile",
+        action="store",
+        default=None,
+        metavar="DIR",
+        help="Profile the call of every repeat of the tests run with cProfile, "
+        "write the statistics merged over the repeats of each test to "
+        "DIR/NODEID.prof and list the functions taking the most time")
+
+    group.addoption(
+        "--probtest-cprofile-select",
+        action="store",
+        default=None,
+        metavar="EXPR",
+        help="Only profile the tests matching the keyword expression EXPR with "
+        "--probtest-cprofile, e.g. 'test_insert and not slow'")
+
+    group.addoption(
+        "--probtest-detect-deterministic",
+        action="store_true",
+        help="Run a test only once if its first repeat draws no randomness "
+        "from random, numpy.random or scipy.stats")
+
+    group.addoption(
+        "--probtest-stop-on-coverage",
+        action="store_true",
+        help="Stop repeating a test when all N outcomes have been recorded "
+        "with the probtest_outcome fixture")
+
 @pytest.hookimpl(trylast=True)
 def pytest_configure(config: Config):
     """Given a specification when the --probtest flag is enabled, checks
     whether the specification is valid and, if valid, computes the number of times k
     to run each test using results from the coupon collector's problem."""
 
+    config.addinivalue_line("markers",
+                    "probtest(p=None, minp=None, N=None, Pbug=None, epsilon=None):"
+                    "specification of a test, class or module overriding the "
+                    "specification given on the command line")
+    config.addinivalue_line("markers",
+                    "probtest_deterministic:"
+                    "mark a test as deterministic, so that it is only run once")
+    config.addinivalue_line("markers",
+                    "probtest_batch(size=None):"
+                    "mark a test that draws a batch of samples of the program in each "
+                    "call, with the number of samples given by the probtest_batch_size fixture")
+    config.addinivalue_line("markers",
+                    "probtest_thread_safe:"
+                    "allow the repeats of a test to run concurrently with --probtest-threads")
+
     if config.getoption('probtest'):
         global k #number of times to run each test
 
-        # Add a marker that is later used when adding dependencies between subtests.
+        # Add markers that are later used when reporting subtests.
         # The last subtest of a number of subtests of a test (identical copies
-        # of the original test) has no other tests dependent on this.
+        # of the original test) is the one reported when all subtests pass.
+        config.addinivalue_line("markers", 
+                        "subtest():"
+                        "mark a test as a repeat of a repeated test")
         config.addinivalue_line("markers", 
                         "last_subtest():"
                         "mark a test as the last test of a repeated test")
+        config.stash[stopped_key] = {}
+        config.stash[outcomes_key] = {}
+        config.stash[saved_key] = []
+        config.stash[specs_key] = {}
+
+        cache = getattr(config, "cache", None) # None if cacheprovider is disabled
+        # Repeating seeds that failed before would bias a sequential test.
+        config.stash[failed_seeds_key] = (cache.get(SEEDS_CACHE_KEY, {}) if cache is not None
+                                          and not config.getoption('probtest_sprt') else {})
+        config.stash[results_key] = {}
+        config.stash[samples_key] = {}
+        if config.getoption('probtest_budget') is not None:
+            config.option.probtest_incremental = True
+            if config.option.probtest_budget < 1:
+                pytest.exit("Please provide a positive --probtest-budget.")
+        if config.getoption('probtest_incremental'):
+            import probtest_certify
+            config.stash[certified_key] = probtest_certify.load(config)
+        if config.getoption('probtest_profile') or config.getoption('probtest_profile_path'):
+            import probtest_profile
+            try:
+                probtest_profile.start(config, config.option.probtest_profile_path)
+            except ValueError as e:
+                pytest.exit("--probtest-profile-path: "+str(e))
+        if config.getoption('probtest_cprofile_select') is not None and not config.getoption('probtest_cprofile'):
+            pytest.exit("Please provide --probtest-cprofile to select the tests to profile.")
+        if config.getoption('probtest_cprofile'):
+            import probtest_cprofile
+            try:
+                probtest_cprofile.start(config, config.option.probtest_cprofile,
+                                        config.option.probtest_cprofile_select)
+            except ValueError as e:
+                pytest.exit("--probtest-cprofile-select: "+str(e))
+
+        seed = config.getoption('probtest_seed')
+        config.stash[base_seed_key] = seed if seed is not None else secrets.randbits(63)
+        if config.getoption('probtest_replay'):
+            nodeid, _, index = config.option.probtest_replay.rpartition('@')
+            if not nodeid or not index.isdigit():
+                pytest.exit("Please provide the repeat to replay as NODEID@INDEX, "+
+                            "e.g. --probtest-replay test_die.py::test_f@17")
+            config.stash[replay_key] = (nodeid, int(index))
+        if (config.getoption('probtest_recycle_repeats') or config.getoption('probtest_recycle_memory')
+                or config.getoption('probtest_preload')) and not config.getoption('probtest_workers'):
+            pytest.exit("Please provide --probtest-workers to recycle or preload workers.")
+        if config.getoption('probtest_recycle_repeats') < 0 or config.getoption('probtest_recycle_memory') < 0:
+            pytest.exit("Please provide a positive number of repeats or MiB to recycle workers after.")
+        if config.getoption('probtest_preload'):
+            import probtest_parallel
+            try:
+                probtest_parallel.preload(config.option.probtest_preload.split(','))
+            except ImportError as e:
+                pytest.exit("--probtest-preload: "+str(e))
+        if config.getoption('probtest_fork'):
+            if config.option.probtest_fork < 1:
+                pytest.exit("Please provide a positive batch size for --probtest-fork.")
+            if config.getoption('probtest_workers'):
+                pytest.exit("--probtest-fork cannot be combined with --probtest-workers.")
+            if not hasattr(os, 'fork'):
+                pytest.exit("--probtest-fork requires os.fork, which this platform lacks.")
+
+        if config.getoption('probtest_sprt'):
+            import probtest_sprt
+            try:
+                config.stash[sprt_key] = probtest_sprt.parse(config.option.probtest_sprt)
+            except ValueError as e:
+                pytest.exit(str(e))
+            if (config.getoption('probtest_workers') or config.getoption('probtest_fork')
+                    or config.getoption('probtest_threads') or config.getoption('probtest_async_concurrency')
+                    or config.getoption('probtest_incremental')):
+                pytest.exit("--probtest-sprt runs the repeats of a test one after another in the pytest process, "+
+                            "and cannot be combined with --probtest-workers, --probtest-fork, --probtest-threads, "+
+                            "--probtest-async-concurrency, --probtest-incremental or --probtest-budget.")
+            if not config.getoption('p') and not config.getoption('minp') and not config.getoption('Pbug'):
+                config.option.Pbug = config.stash[sprt_key].p1
 
         # Argument error handling:
         if (not config.getoption('p')) and not config.getoption('minp') and not config.getoption('Pbug'):
@@ -96,9 +479,7 @@ def pytest_configure(config: Config):
             )
 
         # Computing k:
-        if config.getoption('minp') and config.getoption('N'):
-            config.option.p = [config.option.minp]*config.option.N
-        elif config.getoption('p'):
+        if config.getoption('p'):
             # if p is provided, e.g. as --p "0.1,0.2", we save p as a list of floats
             p = []
             config.option.N=len(config.option.p.split(","))
@@ -108,21 +489,186 @@ def pytest_configure(config: Config):
                 except ValueError:
                     pytest.exit("Please provide p as a vector of floats or fractions, e.g. 0.5,0.5 or 1/2,1/2.")
             config.option.p = p
+            P, counts = ccp_table.group(config.option.p)
+        elif config.getoption('minp'):
+            # All N outcomes share the probability minp, so they are 
+            # kept as a single group instead of a list of length N.
+            P, counts = [config.option.minp], [config.option.N]
         elif config.getoption('Pbug'):
             if float(config.option.Pbug)==1:
                 config.option.p = [float(config.option.Pbug)]
             else:
                 config.option.p = [float(config.option.Pbug),1-float(config.option.Pbug)]
             config.option.N = len(config.option.p)
+            P, counts = ccp_table.group(config.option.p)
+
+        config.stash[command_line_spec_key] = (P, counts)
+        if config.getoption('probtest_global_epsilon') is not None:
+            if not 0 < config.option.probtest_global_epsilon < 1:
+                pytest.exit("Please provide --probtest-global-epsilon between 0 and 1.")
+            import probtest_epsilon
+            config.stash[costs_key] = probtest_epsilon.load(config)
 
         try:
-            k = ccp_upper_bound.ccp(
-                config.getoption('epsilon'),
-                config.getoption('N'),
-                config.getoption('p'))
+            k = compute_k(config, config.getoption('epsilon'), P, counts)
         except ValueError as e:
             pytest.exit(e)
 
+def compute_k(config, epsilon, P, counts):
+    """Returns the number of times to run each test given the specification
+    where the probability P[i] is shared by counts[i] outcomes.
+
+    k is looked up in the table shipped with the plugin and in the values 
+    computed in previous sessions (stored in .pytest_cache) before it is
+    computed, so that repeated sessions with the same specification do not
+    solve the coupon collector's problem again.
+
+    Raises:
+        ValueError: When the specification is not valid.
+    """
+
+    key = ccp_table.spec_key(epsilon, P, counts)
+    if key in config.stash[specs_key]:
+        return config.stash[specs_key][key]
+    k = ccp_table.lookup(epsilon, P, counts)
+    if k is None:
+        k = cached_k(config, key, epsilon, P, counts)
+    config.stash[specs_key][key] = k
+    return k
+
+def cached_k(config, key, epsilon, P, counts):
+    """Returns k for the specification from .pytest_cache, or computes it
+    and stores it there."""
+
+    cache = getattr(config, "cache", None) # None if cacheprovider is disabled
+    computed = cache.get(K_CACHE_KEY, {}) if cache is not None else {}
+    if key in computed:
+        return computed[key]
+
+    import ccp_upper_bound
+    k = ccp_upper_bound.ccp_grouped(epsilon, P, counts)
+    if cache is not None:
+        computed[key] = k
+        cache.set(K_CACHE_KEY, computed)
+    return k
+
+def marker_spec(config, marker):
+    """Returns epsilon and the distinct probabilities of the outcomes with
+    their multiplicities given the specification of a probtest marker, 
+    e.g. @pytest.mark.probtest(Pbug=0.25). If epsilon is not given, the 
+    epsilon of the command line is used.
+
+    Raises:
+        ValueError: When the specification is not valid.
+    """
+
+    unknown = set(marker.kwargs) - {'p', 'minp', 'N', 'Pbug', 'epsilon'}
+    if unknown or marker.args:
+        raise ValueError("The probtest marker takes the keyword arguments p, minp, N, Pbug and epsilon.")
+
+    p, minp, N, Pbug = (marker.kwargs.get(name) for name in ('p', 'minp', 'N', 'Pbug'))
+    epsilon = marker.kwargs.get('epsilon', config.getoption('epsilon'))
+
+    if p is None and minp is None and Pbug is None:
+        raise ValueError("Please provide a specification of the program.")
+    if [p, minp, Pbug].count(None) < 2:
+        raise ValueError("Please provide either p, minp or Pbug.")
+
+    if p is not None:
+        if isinstance(p, str):
+            p = [string_to_float(s) for s in p.split(",")]
+        P, counts = ccp_table.group(p)
+    elif minp is not None:
+        if N is None:
+            raise ValueError("Please provide the number of possible outcomes N when providing p_min.")
+        P, counts = [float(minp)], [int(N)]
+    elif float(Pbug)==1:
+        P, counts = [1.0], [1]
+    else:
+        P, counts = ccp_table.group([float(Pbug), 1-float(Pbug)])
+    return epsilon, P, counts
+
+def get_spec(config, node):
+    """Returns the number of times k to run the test node and its number
+    of outcomes N, given by its closest probtest marker or else by the 
+    command line specification."""
+
+    if node.get_closest_marker('probtest_deterministic') is not None:
+        return 1, 1
+    marker = node.get_closest_marker('probtest')
+    if marker is None:
+        return k, config.option.N
+    try:
+        epsilon, P, counts = marker_spec(config, marker)
+        return compute_k(config, epsilon, P, counts), sum(counts)
+    except ValueError as e:
+        raise pytest.UsageError(node.nodeid+": "+str(e))
+
+def allocate_epsilon(config, items):
+    """Splits --probtest-global-epsilon over the tests by the cost of their
+    repeats and sets their number of repeats k. Tests whose marker gives an
+    epsilon keep it, and it is taken from the global epsilon."""
+
+    import probtest_epsilon
+    epsilon = config.getoption('probtest_global_epsilon')
+    tests = []
+    for item in items:
+        if item.get_closest_marker('probtest_deterministic') is not None:
+            continue
+        marker = item.get_closest_marker('probtest')
+        if marker is not None and 'epsilon' in marker.kwargs:
+            epsilon -= marker.kwargs['epsilon']
+            continue
+        P, counts = marker_spec(config, marker)[1:] if marker else config.stash[command_line_spec_key]
+        # A test with a single certain outcome needs one repeat for any epsilon.
+        if min(P) < 1:
+            tests.append((item, P, counts))
+    if not tests:
+        return
+    if epsilon <= 0:
+        raise pytest.UsageError("--probtest-global-epsilon is used up by the epsilons of probtest markers")
+
+    costs = [config.stash[costs_key].get(item.nodeid) for item, _, _ in tests]
+    epsilons = probtest_epsilon.allocate(epsilon, [(cost, min(P)) for cost, (_, P, _) in zip(costs, tests)])
+    allocation = config.stash.setdefault(allocation_key, [])
+    for (item, P, counts), cost, epsilon in zip(tests, costs, epsilons):
+        item.stash[k_key] = compute_k(config, epsilon, P, counts)
+        allocation.append((item.nodeid, cost, epsilon, item.stash[k_key]))
+
+def pytest_collection_finish(session):
+    """Once the tests have been selected with -k and -m, splits
+    --probtest-global-epsilon over them and resumes the tests certified in
+    earlier sessions with --probtest-incremental. Rejects the tests using
+    shared samples whose repeats are run in other processes, threads or on
+    the async loop, as the samples are kept in the pytest process and each
+    repeat would draw its own."""
+
+    config = session.config
+    if not config.getoption('probtest'):
+        return
+    if config.getoption('probtest_global_epsilon') is not None:
+        allocate_epsilon(config, session.items)
+
+    if config.getoption('probtest_incremental'):
+        import probtest_certify
+        certified = config.stash[certified_key]
+        for item in session.items:
+            item.stash[fingerprint_key] = probtest_certify.fingerprint(item, spec(item))
+            entry = certified.get(item.nodeid, {})
+            passes = entry.get("passes", 0) if entry.get("hash")==item.stash[fingerprint_key] else 0
+            item.stash[resume_key] = passes
+            if passes >= repeat_count(item):
+                item.add_marker(pytest.mark.skip(
+                    reason="certified with "+str(passes)+" passing repeats in earlier sessions"))
+
+    for item in session.items:
+        names = shared_samples(item)
+        if names and (config.getoption('probtest_workers') or config.getoption('probtest_fork')
+                      or concurrent(item)):
+            raise pytest.UsageError(item.nodeid+": the shared samples "+", ".join(names)
+                +" cannot be shared by repeats run with --probtest-workers, --probtest-fork, "
+                +"--probtest-threads or --probtest-async-concurrency")
+
 def string_to_float(str):
     try:
         return float(str)
@@ -136,8 +682,13 @@ def pytest_report_header(config):
         header = "\nThanks for using probtest!\n"
 
         approach = "Your tests are being run "+str(k)+" times.\n"
+        if config.getoption('probtest_global_epsilon') is not None:
+            approach = "Your tests are being run a number of times given per test at the end of the session.\n"
 
         parameters = "\nEpsilon: "+ str(config.option.epsilon) +"\n"
+        if config.getoption('probtest_global_epsilon') is not None:
+            parameters = ("\nGlobal epsilon: "+str(config.option.probtest_global_epsilon)
+                          +", split over the tests by the cost of their repeats\n")
         if config.getoption('p'):
             # p_formatted = [ '%.4f' % p_i for p_i in config.option.p ]
             p_formatted = list(map(lambda x: round(x, ndigits=4), config.option.p))
@@ -148,50 +699,676 @@ def pytest_report_header(config):
             parameters += "N: "+ str(config.option.N) +"\n"
         if config.getoption('Pbug'):
             parameters += "P(bug): "+ str(config.option.Pbug) +"\n"
+        if config.getoption('probtest_threads'):
+            import probtest_threads
+            parameters += ("Threads: "+str(config.option.probtest_threads)
+                           +(" (GIL enabled)" if probtest_threads.gil_enabled() else " (free-threaded)")+"\n")
+        if sprt_key in config.stash:
+            parameters += config.stash[sprt_key].describe()+", instead of "+str(k)+"\n"
+        parameters += "Seed: "+str(config.stash[base_seed_key])+"\n"
         return header+approach+parameters
 
+@pytest.hookimpl(trylast=True)
 def pytest_generate_tests(metafunc):
-    """Generates k copies of each test."""
-    if metafunc.config.getoption('probtest'):
+    """Generates k copies of each test. Runs after the other parametrizations
+    of the test, so that the copies of a test are collected one after the
+    other."""
+    if metafunc.config.getoption('probtest') and not single_item(metafunc.config):
         metafunc.fixturenames.append('repeat')
-        metafunc.parametrize('repeat', range(k),indirect=True)
+        k = get_spec(metafunc.config, metafunc.definition)[0]
+        size = batch_size(metafunc.config, metafunc.definition)
+        metafunc.parametrize('repeat', range(k if size is None else -(-k//size)),indirect=True)
+
+def batch_size(config, node):
+    """Returns the number of samples drawn by each call of a test marked
+    probtest_batch, or None if the test is not marked."""
+
+    marker = node.get_closest_marker('probtest_batch')
+    if marker is None:
+        return None
+    size = marker.kwargs.get('size', marker.args[0] if marker.args else None)
+    if size is None:
+        size = config.getoption('probtest_batch_size')
+    if not isinstance(size, int) or size<1:
+        raise pytest.UsageError(node.nodeid+": the batch size must be a positive integer")
+    return size
+
+def spec(item):
+    """Returns the specification of item that its certification depends on:
+    the command line specification, its probtest marker, its number of
+    repeats and its batch size. With --probtest-global-epsilon, k follows
+    the costs measured in each session, so the global epsilon is part of
+    the specification instead, and the passing repeats are counted towards
+    the k of the session."""
+
+    config = item.config
+    marker = item.get_closest_marker('probtest')
+    global_epsilon = config.getoption('probtest_global_epsilon')
+    return (config.option.epsilon if global_epsilon is None else ("global", global_epsilon),
+            config.option.p, config.option.minp, config.option.N,
+            config.option.Pbug, marker.args if marker else None,
+            sorted(marker.kwargs.items()) if marker else None,
+            item.stash[k_key] if global_epsilon is None else None, item.stash.get(batch_key, None))
+
+def resumed_repeats(item):
+    """Returns the repeats of item to run in this session with 
+    --probtest-incremental: those after the passing repeats accumulated in
+    earlier sessions, at most --probtest-budget of them."""
+
+    start = item.stash[resume_key]
+    stop = repeat_count(item)
+    budget = item.config.getoption('probtest_budget')
+    if budget is not None:
+        stop = min(stop, start+budget)
+    # A certified test is skipped in its setup, which is run once.
+    return range(start, max(stop, start+1))
+
+def certify(item, repeats, runs, reports):
+    """Records the passing repeats of item accumulated over sessions after
+    running the given repeats of it."""
+
+    if any(report.skipped for report in reports):
+        return
+    if any(report.failed for report in reports):
+        passes = 0
+    elif original_test(item) in item.config.stash[stopped_key]:
+        # Stopped early as no more repeats are needed.
+        passes = repeat_count(item)
+    else:
+        passes = repeats.start+runs
+    item.config.stash[certified_key][item.nodeid] = {
+        "hash": item.stash[fingerprint_key], "passes": passes}
+    if 0 < passes < repeat_count(item):
+        item.config.stash.setdefault(partial_key, []).append((item.nodeid, passes, repeat_count(item)))
+
+def repeat_count(item):
+    """Returns the number of times to call the test of item: k, or the
+    number of batches of k samples for a batch test."""
+
+    k = item.stash[k_key]
+    size = item.stash.get(batch_key, None)
+    return k if size is None else -(-k//size)
+
+def failed_in(item):
+    """Describes the failing repeat of item, or for a batch test, its
+    failing sample or batch."""
+
+    i = repeat_index(item)
+    size = item.stash.get(batch_key, None)
+    if size is None:
+        return "repeat "+str(i)
+    if sample_key in item.stash:
+        return "sample "+str(item.stash[sample_key])
+    return ("batch "+str(i)+" (samples "+str(i*size)+" to "
+            +str(min((i+1)*size, item.stash[k_key])-1)+")")
+
+def single_item(config):
+    """Returns whether each test is collected once and repeated when it is
+    run, which is needed to run its repeats in parallel."""
+    return (config.getoption('probtest_single_item') or bool(config.getoption('probtest_workers'))
+            or bool(config.getoption('probtest_replay')) or config.getoption('probtest_aggregate')
+            or config.getoption('probtest_incremental') or config.getoption('probtest_budget') is not None
+            or bool(config.getoption('probtest_threads'))
+            or bool(config.getoption('probtest_async_concurrency'))
+            or bool(config.getoption('probtest_fork'))
+            or bool(config.getoption('probtest_sprt'))
+            or config.getoption('probtest_global_epsilon') is not None)
+
+def concurrent(item):
+    """Returns whether the repeats of item are run concurrently: on an event
+    loop if its test function is a coroutine function, and otherwise in 
+    threads if it is marked as thread safe."""
+
+    if inspect.iscoroutinefunction(getattr(item, 'obj', None)):
+        return bool(item.config.getoption('probtest_async_concurrency'))
+    if batch_key in item.stash:
+        return False
+    return (bool(item.config.getoption('probtest_threads'))
+            and item.get_closest_marker('probtest_thread_safe') is not None)
+
+def original_test(item):
+    """Returns a key identifying the original test that the subtest item
+    is a copy of: its parent, its function and the ids of its other 
+    parameters. The repeat parameter is added after all other parameters
+    in pytest_generate_tests, so its id is the last part of the id.
+    In single item mode, the item is the original test."""
+
+    if not is_subtest(item):
+        return item
+    repeat_id = str(item.callspec.params['repeat'])
+    params = item.callspec.id[:-len(repeat_id)-1] if item.callspec.id!=repeat_id else ""
+    return (item.parent, item.function, params)
+
+def original_nodeid(item):
+    """Returns the node id of the original test of item."""
+    if not is_subtest(item):
+        return item.nodeid
+    params = original_test(item)[2]
+    return item.parent.nodeid+"::"+item.originalname+("["+params+"]" if params else "")
+
+def is_subtest(item):
+    return hasattr(item, "callspec") and 'repeat' in item.callspec.params
+
+def repeat_index(item):
+    """Returns the index of the repeat of the test that item is running."""
+    if is_subtest(item):
+        return item.callspec.params['repeat']
+    return item.stash.get(repeat_key, 0)
 
 def pytest_collection_modifyitems(session,config,items):
     """Modifies the tests generated in pytest_generate_tests:
-    Adds dependencies (using pytest-dependency) between the subtests 
-    so that if the jth subtest fails, the consecutive subtests of this type
-    will be skipped."""
+    Marks the subtests, and the last subtest of each original test, which
+    are used when reporting them, and stores the number of times to run 
+    each test and the batch size of batch tests. The number of times is
+    changed in pytest_collection_finish with --probtest-global-epsilon."""
+
+    for item in items:
+        size = batch_size(config, item)
+        if size is not None:
+            item.stash[batch_key] = size
 
     if config.getoption('probtest'):
-        current_main_test = ""
-        previous_sub_test = ""
-        previous_item=None
+        for item in items:
+            item.stash[k_key], item.stash[n_key] = get_spec(config, item)
+
+    if config.getoption('probtest_replay'):
+        nodeid = config.stash[replay_key][0]
+        selected = [item for item in items if item.nodeid==nodeid]
+        if not selected:
+            raise pytest.UsageError("--probtest-replay: no test with node id "+nodeid)
+        config.hook.pytest_deselected(items=[item for item in items if item.nodeid!=nodeid])
+        items[:] = selected
 
-        i=0
+    if config.getoption('probtest') and not single_item(config):
+        last_subtests = {}
         for item in items:
-            if item.name.__contains__("[0]"):
-                current_main_test = item.name
-                item.add_marker(pytest.mark.dependency())
-                if previous_item!=None: previous_item.add_marker(pytest.mark.last_subtest)
-                previous_sub_test = current_main_test
-                previous_item = item
-            else:
-                item.add_marker(pytest.mark.dependency(depends=[previous_sub_test]))
-                previous_sub_test = item.name
-                previous_item = item
-            if i==len(items)-1:previous_item.add_marker(pytest.mark.last_subtest)
-            i+=1
+            if is_subtest(item):
+                item.add_marker(pytest.mark.subtest)
+                last = last_subtests.get(original_test(item))
+                if last is None or last.callspec.params['repeat'] < item.callspec.params['repeat']:
+                    last_subtests[original_test(item)] = item
+        for item in last_subtests.values():
+            item.add_marker(pytest.mark.last_subtest)
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    """Skips a subtest before its fixtures are set up if an earlier subtest
+    of the same original test has failed, or if no more repeats are needed.
+    Otherwise, seeds the global random generators with the seed of the 
+    repeat, which for the first repeats is a seed that failed in an earlier
+    session, and starts detecting whether the first repeat of a test draws
+    randomness."""
+
+    config = item.config
+    if not config.getoption('probtest'):
+        return
+
+    stopped = config.stash[stopped_key].get(original_test(item))
+    if stopped is not None and is_subtest(item):
+        pytest.skip(item.name+" skipped as "+stopped)
+
+    failed_seeds = config.stash[failed_seeds_key].get(original_nodeid(item), [])
+    if repeat_index(item) < len(failed_seeds):
+        item.stash[seed_key] = failed_seeds[repeat_index(item)]
+    else:
+        item.stash[seed_key] = probtest_random.derive_seed(
+            config.stash[base_seed_key], original_nodeid(item), repeat_index(item))
+    probtest_random.seed_globals(item.stash[seed_key])
+
+    if config.getoption('probtest_detect_deterministic') and repeat_index(item)==0:
+        item.stash[probe_key] = probtest_random.RandomnessProbe()
+        module = getattr(item, "module", None)
+        item.stash[probe_key].start(vars(module).values() if module else ())
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    """Records the first failing repeat of each original test, and stops
+    repeating a test whose first repeat passed without drawing randomness.
+    With --probtest-sprt, a failing repeat only fails the test once the
+    sequential test accepts that there is a bug.
+    The report of the last repeat that is run is marked as the last subtest.
+    """
+
+    outcome = yield
+    report = outcome.get_result()
+    config = item.config
+    if not config.getoption('probtest'):
+        return
+
+    stopped = config.stash[stopped_key]
+    tolerated = False
+    walk = item.stash.get(walk_key, None)
+    if walk is not None and report.when=='call':
+        bug = walk.observe(report.failed)
+        tolerated = bug is None and report.failed
+        if bug is not None:
+            decide(item, report, walk, bug)
+    if report.failed and not tolerated:
+        stopped.setdefault(original_test(item), failed_in(item)+" failed")
+        # Concurrent repeats share the seed of their one setup, with which a
+        # replay need not reproduce the failure.
+        if seed_key in item.stash and not concurrent(item):
+            failed_seeds = config.stash[failed_seeds_key].get(original_nodeid(item), [])
+            # A shared sample is drawn for the index of the repeat rather
+            # than its seed, so the seed is not stored to be run first.
+            if not shared_samples(item):
+                report.user_properties.append(("probtest_seed", item.stash[seed_key]))
+            report.sections.append(("probtest", "Seed "+str(item.stash[seed_key])
+                +(" (failed in an earlier session)" if repeat_index(item) < len(failed_seeds) else "")
+                +", replay with --probtest-seed "+str(config.stash[base_seed_key])
+                +" --probtest-replay '"+original_nodeid(item)+"@"+str(repeat_index(item))+"'"))
+
+    record_result(config, original_nodeid(item), report)
+
+    probe = item.stash.get(probe_key, None)
+    if probe is not None:
+        if report.when=='setup' and report.passed:
+            probe.watch(item.funcargs.values())
+        else:
+            del item.stash[probe_key]
+            if not probe.stop() and report.when=='call' and report.passed:
+                stop_early(item, report, "repeat 0 drew no randomness")
+
+    if config.getoption('probtest_stop_on_coverage') and report.when=='call' and report.passed:
+        outcomes = config.stash[outcomes_key].get(original_test(item), ())
+        if len(outcomes)>=item.stash[n_key]:
+            stop_early(item, report, "all "+str(len(outcomes))+" outcomes were observed")
+
+def decide(item, report, walk, bug):
+    """Fails the test of the report of its last repeat if the sequential
+    test accepted that there is a bug, and otherwise passes it and stops
+    repeating it."""
+
+    if bug:
+        if report.passed:
+            report.outcome = "failed"
+            report.longrepr = walk.describe(bug)
+        report.sections.append(("probtest", walk.describe(bug)))
+    else:
+        if report.failed:
+            report.outcome = "passed"
+            report.longrepr = None
+        stop_early(item, report, walk.describe(bug))
+
+def record_result(config, nodeid, report):
+    """Records the seed of a failing report of the test nodeid, or that a
+    call of it passed, so that the failed seeds can be stored at the end of
+    the session."""
+
+    results = config.stash[results_key]
+    seed = dict(report.user_properties).get("probtest_seed")
+    if report.failed and seed is not None and results.get(nodeid) is None:
+        results[nodeid] = seed
+    elif report.when=='call' and report.passed:
+        results.setdefault(nodeid, None)
+
+def pytest_sessionfinish(session):
+    """Stores the seeds of the failing repeats of this session in 
+    .pytest_cache, and forgets the stored seeds of tests that passed.
+    With --probtest-global-epsilon, stores the costs of their repeats."""
+
+    config = session.config
+    cache = getattr(config, "cache", None)
+    if config.getoption('probtest') and config.getoption('probtest_global_epsilon') is not None:
+        import probtest_epsilon
+        probtest_epsilon.store(config, config.stash[costs_key])
+    if (not config.getoption('probtest') or cache is None or config.getoption('probtest_replay')
+            or config.getoption('probtest_sprt')):
+        return
+
+    stored = config.stash[failed_seeds_key]
+    for nodeid, seed in config.stash[results_key].items():
+        if seed is None:
+            stored.pop(nodeid, None)
+        elif seed not in stored.setdefault(nodeid, []) and len(stored[nodeid]) < MAX_FAILED_SEEDS:
+            stored[nodeid].append(seed)
+    cache.set(SEEDS_CACHE_KEY, stored)
+
+    if config.getoption('probtest_incremental'):
+        import probtest_certify
+        probtest_certify.store(config, config.stash[certified_key])
+
+def stop_early(item, report, reason):
+    """Skips the remaining repeats of the test of the passing report, and
+    records the runs saved."""
+
+    stopped = item.config.stash[stopped_key]
+    if original_test(item) in stopped:
+        return
+    stopped[original_test(item)] = reason
+    report.keywords['last_subtest'] = 1
+
+    runs = repeat_index(item)+1
+    if batch_key in item.stash:
+        runs = min(runs*item.stash[batch_key], item.stash[k_key])
+    if runs < item.stash[k_key]:
+        item.config.stash[saved_key].append((original_nodeid(item), reason, runs, item.stash[k_key]))
+
+def shared_sample(function):
+    """Decorates a function scoped fixture, below @pytest.fixture, whose 
+    value is a sample of the program under test, so that it is drawn once 
+    per repeat and shared by all tests using it: repeat i of every test 
+    gets the i'th sample, instead of each test drawing its own k samples.
+    The samples are kept in the pytest process, so they cannot be shared
+    by repeats run in workers, forked children, threads or on the async
+    loop.
+
+    Example:
+        @pytest.fixture
+        @probtest.shared_sample
+        def o():
+            return throw_die()
+    """
+
+    function.probtest_shared_sample = True
+    return function
+
+def shared_samples(item):
+    """Returns the names of the shared sample fixtures that item uses."""
+
+    fixtureinfo = getattr(item, '_fixtureinfo', None)
+    if fixtureinfo is None:
+        return []
+    return [name for name, fixturedefs in fixtureinfo.name2fixturedefs.items()
+            if getattr(fixturedefs[-1].func, 'probtest_shared_sample', False)]
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_fixture_setup(fixturedef, request):
+    """Sets up a shared sample fixture with the value drawn for the repeat
+    by the first test that used it, or draws and keeps the value. Leaves
+    out the fixtures that are set up for each repeat of a test whose
+    repeats are run concurrently."""
+
+    config = request.config
+    if not config.getoption('probtest') or fixturedef.scope!='function':
+        return None
+    if concurrent_key in request.node.stash:
+        import probtest_fixtures
+        if fixturedef.argname in probtest_fixtures.repeated(request.node):
+            fixturedef.cached_result = (probtest_fixtures.UNSET, fixturedef.cache_key(request), None)
+            return probtest_fixtures.UNSET
+    if not getattr(fixturedef.func, 'probtest_shared_sample', False):
+        return None
+
+    samples = config.stash[samples_key]
+    key = (fixturedef.baseid, fixturedef.argname, fixturedef.cache_key(request), repeat_index(request.node))
+    if key not in samples:
+        from _pytest.fixtures import pytest_fixture_setup as setup
+        # Drawn with a seed of the fixture and the repeat, so that the sample
+        # does not depend on the test that draws it and a replay of any test
+        # using it draws it again. The test then draws as if it had not.
+        states = probtest_random.global_states()
+        probtest_random.seed_globals(probtest_random.derive_seed(
+            config.stash[base_seed_key], repr(key[:3]), key[3]))
+        try:
+            samples[key] = setup(fixturedef, request)
+        finally:
+            probtest_random.set_global_states(states)
+    else:
+        fixturedef.cached_result = (samples[key], fixturedef.cache_key(request), None)
+    return samples[key]
+
+@pytest.fixture
+def probtest_batch_size(request):
+    """Returns the number of samples of the program under test that a test
+    marked probtest_batch should draw in this call: the batch size, or 
+    fewer in the last batch of k samples."""
+
+    item = request.node
+    size = batch_size(item.config, item)
+    if size is None:
+        pytest.fail("probtest_batch_size requires the probtest_batch marker", pytrace=False)
+    if not item.config.getoption('probtest'):
+        return size
+    return min(size, item.stash[k_key]-repeat_index(item)*size)
+
+@pytest.fixture
+def probtest_rng(request):
+    """Returns a numpy random generator seeded with the seed of the repeat
+    of the test, so that a failing repeat can be replayed."""
+
+    import numpy
+    return numpy.random.default_rng(request.node.stash.get(seed_key, None))
+
+@pytest.fixture
+def probtest_outcome(request):
+    """Returns a function that records the outcome of the program under
+    test observed in a run of the test, e.g. probtest_outcome(o) for the 
+    value o of a thrown die. With --probtest-stop-on-coverage, a test is
+    not repeated further once all N outcomes have been recorded."""
+
+    item = request.node
+    if not item.config.getoption('probtest'):
+        return lambda outcome: None
+    return item.config.stash[outcomes_key].setdefault(original_test(item), set()).add
+
+def run_repeats(item, repeats, cancelled=lambda: False):
+    """Runs the given repeats of item until the test is stopped or the 
+    cancelled predicate holds. After each repeat, the test is torn down up
+    to its parent, so that only function scoped fixtures are set up again
+    in the next repeat. With --probtest-aggregate, the duration of each 
+    repeat is appended to item.stash[durations_key], and only the reports 
+    of the last repeat are kept.
+
+    Returns:
+        The index of the last repeat run, the number of repeats run, and 
+        the reports of the last repeat run.
+    """
+
+    stopped = item.config.stash[stopped_key]
+    durations = item.stash.get(durations_key, None)
+    progress = None
+    if durations is not None:
+        import probtest_aggregate
+        progress = probtest_aggregate.Progress(item.config, item.nodeid, len(repeats))
+
+    i, runs, reports = None, 0, []
+    for i in repeats:
+        if cancelled():
+            break
+        item.stash[repeat_key] = i
+        reports = runtestprotocol(item, log=False, nextitem=item.parent)
+        runs += 1
+        if durations is not None:
+            durations.append(sum(report.duration for report in reports))
+            progress.update(runs)
+        if original_test(item) in stopped:
+            break
+    return i, runs, reports
+
+def run_concurrently(item, k):
+    """Runs the k repeats of item with one setup and teardown, calling the
+    test function concurrently in pytest_pyfunc_call.
+
+    Returns:
+        The index of the first failing repeat, or of the last repeat if all
+        passed, the number of repeats run, and the reports of the test.
+    """
+
+    item.stash[concurrent_key] = k
+    try:
+        _, _, reports = run_repeats(item, range(1))
+        runs = item.stash[concurrent_key] if reports[-1].when!='setup' else 0
+    finally:
+        del item.stash[concurrent_key]
+    return item.stash[repeat_key], runs, reports
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_protocol(item, nextitem):
+    """In single item mode, runs the setup, call and teardown of the test 
+    up to k times and reports them once. Stops at the first failing repeat,
+    whose index is added to the reports, or when no more repeats are 
+    needed. With --probtest-workers, the repeats are run by a pool of 
+    worker processes, and with --probtest-fork, by child processes forked
+    after the setup of the test. With --probtest-threads and
+    --probtest-async-concurrency, the repeats of thread safe tests and of
+    async tests are run concurrently."""
+
+    config = item.config
+    if not (config.getoption('probtest') and single_item(config)):
+        return None
+
+    item.ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+
+    k = item.stash[k_key]
+    repeats = range(repeat_count(item))
+    # A test with a single repeat, e.g. a deterministic test or one with a
+    # certain outcome, is run once, not until the sequential test decides.
+    if (sprt_key in config.stash and replay_key not in config.stash and batch_key not in item.stash
+            and item.stash[k_key] > 1):
+        import probtest_sprt
+        item.stash[walk_key] = probtest_sprt.Walk(config.stash[sprt_key])
+        k = config.stash[sprt_key].limit
+        repeats = range(k)
+    if replay_key in config.stash:
+        index = config.stash[replay_key][1]
+        repeats = range(index, index+1)
+    elif config.getoption('probtest_incremental'):
+        repeats = resumed_repeats(item)
+
+    if config.getoption('probtest_aggregate'):
+        import probtest_aggregate
+        item.stash[durations_key] = probtest_aggregate.durations()
+
+    start = time.perf_counter()
+    if concurrent(item):
+        i, runs, reports = run_concurrently(item, len(repeats))
+    elif config.getoption('probtest_workers'):
+        import probtest_parallel
+        i, runs, reports = probtest_parallel.run_in_workers(item, repeats)
+    elif config.getoption('probtest_fork'):
+        import probtest_fork
+        i, runs, reports = probtest_fork.run_forked(item, repeats)
+    else:
+        i, runs, reports = run_repeats(item, repeats)
+    if config.getoption('probtest_global_epsilon') is not None and runs > 0:
+        config.stash[costs_key][item.nodeid] = (time.perf_counter()-start)/(runs*item.stash.get(batch_key, 1))
+
+    # Tears down the fixtures of higher scopes that nextitem does not use.
+    call = pytest.CallInfo.from_call(
+        lambda: item.session._setupstate.teardown_exact(nextitem), when="teardown")
+    teardown = item.ihook.pytest_runtest_makereport(item=item, call=call)
+    if reports[-1].passed:
+        reports[-1] = teardown
+    elif not teardown.passed:
+        reports.append(teardown)
+
+    if walk_key in item.stash:
+        del item.stash[walk_key]
+    if config.getoption('probtest_incremental') and replay_key not in config.stash:
+        certify(item, repeats, runs, reports)
+    if config.getoption('probtest_aggregate'):
+        import probtest_aggregate
+        failure = i if any(report.failed for report in reports) else None
+        config.stash.setdefault(summaries_key, []).append(probtest_aggregate.summarise(
+            item.nodeid, runs, failure, item.stash[durations_key]))
+        del item.stash[durations_key]
+
+    for report in reports:
+        report.user_properties.append(("probtest_repeats", runs))
+        if report.failed:
+            # The reason a test stopped after failing tells where it failed.
+            reason = config.stash[stopped_key].get(original_test(item), "")
+            where = reason[:-len(" failed")] if reason.endswith(" failed") else "repeat "+str(i)
+            report.sections.append(("probtest", "Failed in "+where+" of "+str(k)))
+        item.ihook.pytest_runtest_logreport(report=report)
+
+    item.ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+    return True
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Calls the test function of a batch test, checking the outcomes of 
+    the samples it returns, and of a test whose repeats are run 
+    concurrently, on an event loop or in the pool of threads."""
+
+    __tracebackhide__ = True
+    if batch_key in pyfuncitem.stash:
+        call_batch(pyfuncitem)
+        return True
+    if concurrent_key not in pyfuncitem.stash:
+        return None
+    if inspect.iscoroutinefunction(pyfuncitem.obj):
+        import probtest_async
+        probtest_async.call_in_loop(pyfuncitem)
+    else:
+        import probtest_threads
+        probtest_threads.call_in_threads(pyfuncitem)
+    return True
+
+def call_batch(item):
+    """Calls the test function of a batch test. If it returns the outcomes
+    of its samples, as a sequence or array that is true for passing 
+    samples, fails at the first failing sample and stores its index."""
+
+    __tracebackhide__ = True
+    if sample_key in item.stash:
+        del item.stash[sample_key]
+    funcargs = {name: item.funcargs[name] for name in item._fixtureinfo.argnames}
+    outcomes = item.obj(**funcargs)
+    if outcomes is None:
+        return
+
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(outcomes, numpy.ndarray):
+        failing = numpy.flatnonzero(~outcomes.astype(bool))
+        j = int(failing[0]) if len(failing) else None
+    else:
+        j = next((j for j, passed in enumerate(outcomes) if not passed), None)
+    if j is not None:
+        item.stash[sample_key] = repeat_index(item)*item.stash[batch_key]+j
+        pytest.fail(failed_in(item)+" failed")
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    """Reports the summaries of the tests with --probtest-aggregate, the
+    tests that are only partially certified with --probtest-incremental, 
+    the epsilon and k of each test with --probtest-global-epsilon, and the
+    runs saved by stopping tests early."""
+
+    if not config.getoption('probtest'):
+        return
+
+    partial = config.stash.get(partial_key, [])
+    saved = config.stash[saved_key]
+    summaries = config.stash.get(summaries_key, [])
+    allocation = config.stash.get(allocation_key, [])
+    if not saved and not partial and not summaries and not allocation:
+        return
+
+    terminalreporter.section("probtest")
+    if allocation:
+        import probtest_aggregate
+        rows = [("test", "cost of a repeat", "epsilon", "k")]
+        for nodeid, cost, epsilon, k in allocation:
+            rows.append((nodeid, "-" if cost is None else "%.4fs" % cost, str(epsilon), str(k)))
+        for line in probtest_aggregate.align(rows):
+            terminalreporter.line(line)
+    if summaries:
+        import probtest_aggregate
+        for line in probtest_aggregate.table(summaries):
+            terminalreporter.line(line)
+    if partial:
+        terminalreporter.line(str(len(partial))+" tests are partially certified:")
+        for nodeid, passes, count in partial:
+            terminalreporter.line(nodeid+": passed "+str(passes)+" of "+str(count)+" repeats")
+    if not saved:
+        return
+    total = sum(k-runs for _, _, runs, k in saved)
+    terminalreporter.line("Stopped "+str(len(saved))+" tests early, saving "+str(total)+" runs.")
+    if config.getoption('verbose')>0:
+        for nodeid, reason, runs, k in saved:
+            terminalreporter.line(nodeid+": ran "+str(runs)+" of "+str(k)+" times as "+reason)
 
 @pytest.hookimpl
 def pytest_report_teststatus(report):
     """Modifies the reporting of the test after they have been run.
-    If not in verbose, does not report tests that are skipped due to 
-    dependencies, and only reports passing a test if it is the last 
+    If not in verbose, does not report subtests that are skipped due to 
+    an earlier failure, and only reports passing a test if it is the last 
     subtest of a type."""
 
-    if report.skipped and report.keywords.__contains__('dependency'):
+    if report.skipped and report.keywords.__contains__('subtest'):
         return "", "", ("SKIPPED", {"yellow": True})
     if report.when=='call':
-        if report.passed and report.keywords.__contains__('dependency'):
+        if report.passed and report.keywords.__contains__('subtest'):
             if not report.keywords.__contains__('last_subtest'):
                 return "", "", ("PASSED", {"green": True})
@@ -0,0 +1,72 @@
+"""Aggregated reporting for the probtest plugin.
+
+With --probtest-aggregate, the repeats of a test are folded into one
+summary record instead of one report each: the number of repeats run, the
+index of the first failing repeat, and the total, minimum, median and
+maximum duration of a repeat. The durations are kept in an array of floats
+while the test runs, and the summaries are printed as a table at the end
+of the session. Progress of long tests is written at most every
+PROGRESS_INTERVAL seconds.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import statistics
+import time
+from array import array
+from collections import namedtuple
+
+PROGRESS_INTERVAL = 5.0
+
+Summary = namedtuple("Summary", "nodeid runs failure total min median max")
+
+class Progress:
+    """Writes the number of repeats run of a test to the terminal, at most
+    every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, config, nodeid, repeats):
+        self.terminal = config.pluginmanager.get_plugin("terminalreporter")
+        self.nodeid = nodeid
+        self.repeats = repeats
+        self.last = time.monotonic()
+
+    def update(self, runs):
+        now = time.monotonic()
+        if self.terminal is not None and now-self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.terminal.write_line(self.nodeid+": "+str(runs)+" of "+str(self.repeats)+" repeats run")
+
+def durations():
+    """Returns an empty buffer for the durations of the repeats of a test."""
+    return array('d')
+
+def summarise(nodeid, runs, failure, durations):
+    """Returns the summary of the repeats of the test nodeid, given the
+    index of its first failing repeat or None, and the durations of the
+    repeats that were timed."""
+
+    if not durations:
+        return Summary(nodeid, runs, failure, None, None, None, None)
+    return Summary(nodeid, runs, failure, sum(durations), min(durations),
+                   statistics.median(durations), max(durations))
+
+def table(summaries):
+    """Returns the lines of a table of the summaries."""
+
+    def seconds(value):
+        return "-" if value is None else "%.4fs" % value
+
+    rows = [("test", "repeats", "failed in", "total", "min", "median", "max")]
+    for s in summaries:
+        rows.append((s.nodeid, str(s.runs), "-" if s.failure is None else str(s.failure),
+                     seconds(s.total), seconds(s.min), seconds(s.median), seconds(s.max)))
+    return align(rows)
+
+def align(rows):
+    """Returns the lines of a table of rows of strings, with the first
+    column aligned to the left and the others to the right."""
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return ["  ".join(cell.ljust(width) if i==0 else cell.rjust(width)
+                      for i, (cell, width) in enumerate(zip(row, widths)))
+            for row in rows]
@@ -0,0 +1,92 @@
+"""Concurrent repeats of async tests for the probtest plugin.
+
+With --probtest-async-concurrency m, the repeats of a test whose function is
+a coroutine function are run on one event loop, with up to m repeats
+awaited at a time, so that latency bound programs, such as simulations of
+networks or queues, do not wait for each other. The fixtures of the test are
+set up once, and each of the m concurrent workers awaits the test with its
+own deep copy of them, in which random generators are reseeded, except for
+the fixtures set up for each repeat by probtest_fixtures, including async
+fixtures, which the worker sets up and tears down. The first failing
+repeat cancels the others.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import asyncio
+import random
+
+import probtest
+import probtest_fixtures
+from probtest_fixtures import Repeat
+from probtest_random import copy_with_streams
+
+def call_in_loop(item):
+    """Awaits the test function of item for the number of repeats stored in
+    item.stash[probtest.concurrent_key], replacing it by the number of
+    repeats run. If a repeat fails, its index is stored as the repeat of
+    item and its exception is raised."""
+
+    config = item.config
+    k = item.stash[probtest.concurrent_key]
+    n = item.stash[probtest.n_key]
+    outcomes = config.stash[probtest.outcomes_key].get(probtest.original_test(item), ())
+    stop_on_coverage = config.getoption('probtest_stop_on_coverage')
+
+    funcargs = probtest_fixtures.shared(item)
+    runs, failures = asyncio.run(gather_repeats(
+        item, funcargs, k, config.getoption('probtest_async_concurrency'),
+        seed=item.stash.get(probtest.seed_key, None),
+        done=lambda: stop_on_coverage and len(outcomes)>=n))
+
+    item.stash[probtest.concurrent_key] = runs
+    if failures:
+        i, exception = min(failures, key=lambda failure: failure[0])
+        item.stash[probtest.repeat_key] = i
+        raise exception
+    item.stash[probtest.repeat_key] = runs-1
+
+async def gather_repeats(item, funcargs, k, limit, seed=None, done=lambda: False):
+    """Awaits the test function of item for the repeats range(k) in up to
+    limit concurrent workers, until a repeat fails or done() holds. The
+    copies of the random generators among the fixture values funcargs are
+    reseeded from seed.
+
+    Returns:
+        The number of repeats that completed, and a list of the failing
+        repeats as tuples of their index and exception.
+    """
+
+    repeats = iter(range(k))
+    seeds = random.Random(seed)
+    runs = 0
+    failures = []
+
+    async def worker():
+        nonlocal runs
+        values = copy_with_streams(funcargs, seeds)
+        for i in repeats:
+            try:
+                fixtures = Repeat(item, values)
+                try:
+                    await fixtures.setup_async()
+                    await item.obj(**fixtures.funcargs())
+                finally:
+                    await fixtures.teardown_async()
+            except BaseException as e:
+                if failures:
+                    # Cancelled by the first failing repeat.
+                    raise
+                runs += 1
+                failures.append((i, e))
+                for task in tasks:
+                    if task is not asyncio.current_task():
+                        task.cancel()
+                return
+            runs += 1
+            if done():
+                return
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(min(limit, k))]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return runs, failures
@@ -0,0 +1,103 @@
+"""Incremental certification for the probtest plugin.
+
+With --probtest-incremental, the number of passing repeats of each test is
+stored in .pytest_cache with a fingerprint of the test: its specification
+and the source of its module, the conftest files above it and the local
+modules that its module uses, directly or through other local modules. A
+later session skips a test whose fingerprint is unchanged once it has
+passed k repeats, and otherwise resumes it from the repeats it has passed.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import hashlib
+import inspect
+import sys
+from pathlib import Path
+
+import pytest
+
+CACHE_KEY = "probtest/certified"
+
+# The hashes of the source files of each test module in this session
+hashes_key = pytest.StashKey[dict]()
+
+def fingerprint(item, spec):
+    """Returns a hash of the specification spec of item and of the source
+    of its module and the local modules it depends on."""
+
+    hashes = item.config.stash.setdefault(hashes_key, {})
+    module = getattr(item, "module", None)
+    if module not in hashes:
+        digest = hashlib.sha256()
+        for path in sorted(source_files(item, module)):
+            digest.update(str(path).encode())
+            digest.update(path.read_bytes())
+        hashes[module] = digest.hexdigest()
+    return hashlib.sha256((hashes[module]+repr(spec)).encode()).hexdigest()
+
+def source_files(item, module):
+    """Returns the paths of the file of item, the conftest files above it
+    and the files of the local modules, those under the root directory
+    outside of installed packages, that its module uses."""
+
+    root = item.config.rootpath.resolve()
+    path = Path(item.path).resolve()
+    files = {path}
+    for directory in path.parents:
+        if (directory / "conftest.py").is_file():
+            files.add(directory / "conftest.py")
+        if directory==root:
+            break
+
+    seen = set()
+    stack = [module] if module is not None else []
+    while stack:
+        for value in list(vars(stack.pop()).values()):
+            dependency = module_of(value)
+            if dependency is None or dependency in seen:
+                continue
+            seen.add(dependency)
+            file = local_file(dependency, root)
+            if file is not None:
+                files.add(file)
+                stack.append(dependency)
+    return files
+
+def module_of(value):
+    """Returns value if it is a module, or else the module that defines it,
+    if any."""
+
+    if inspect.ismodule(value):
+        return value
+    try:
+        name = getattr(value, "__module__", None)
+    except Exception:
+        return None
+    return sys.modules.get(name) if isinstance(name, str) else None
+
+def local_file(module, root):
+    """Returns the path of the source of module if it is under root and
+    not in an installed package, and otherwise None."""
+
+    file = getattr(module, "__file__", None)
+    if not file or not file.endswith(".py"):
+        return None
+    path = Path(file).resolve()
+    if root not in path.parents or "site-packages" in path.parts:
+        return None
+    return path
+
+def load(config):
+    """Returns the stored certifications, keyed by node id, as dicts with
+    the fingerprint of the test and its number of passing repeats."""
+
+    cache = getattr(config, "cache", None)
+    return cache.get(CACHE_KEY, {}) if cache is not None else {}
+
+def store(config, certified):
+    """Stores the certifications in .pytest_cache."""
+
+    cache = getattr(config, "cache", None)
+    if cache is not None:
+        cache.set(CACHE_KEY, certified)
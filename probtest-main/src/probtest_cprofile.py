@@ -0,0 +1,131 @@
+"""Merged cProfile statistics of the repeats of tests for the probtest plugin.
+
+With --probtest-cprofile DIR, the test function of every repeat of a test
+is profiled with one cProfile.Profile per test, so that the statistics of
+all repeats are merged, including paths of the program that only some
+repeats take. At the end of the session, the statistics of each test are
+written to DIR/NODEID.prof, where they can be read with pstats or snakeviz,
+and the functions with the most time of their own across the repeats are
+listed. With --probtest-cprofile-select EXPR, only the tests matching the
+keyword expression EXPR, as given to -k, are profiled.
+
+Only the thread running the test is profiled, so the repeats of tests run
+concurrently in threads or on the async loop are not profiled, and neither
+are repeats run in other processes by --probtest-workers and
+--probtest-fork, for which a warning is issued instead.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import cProfile
+import pstats
+import re
+from pathlib import Path
+
+import pytest
+from _pytest.mark import KeywordMatcher
+from _pytest.mark.expression import Expression
+
+try:
+    from _pytest.mark.expression import ParseError
+except ImportError:
+    # Newer versions of pytest raise SyntaxError for invalid expressions.
+    ParseError = SyntaxError
+
+import probtest
+from probtest_aggregate import align
+
+TOP = 5
+
+class CProfiler:
+    """A plugin that profiles the calls of the repeats of tests."""
+
+    def __init__(self, directory, select=None):
+        self.directory = Path(directory)
+        self.select = select
+        self.profiles = {}
+        self.selected = {}
+
+    @pytest.hookimpl(hookwrapper=True, trylast=True)
+    def pytest_pyfunc_call(self, pyfuncitem):
+        if not self.is_selected(pyfuncitem):
+            yield
+            return
+        # Innermost, so that little of pytest's own calls is profiled.
+        profile = self.profiles.setdefault(probtest.original_nodeid(pyfuncitem), cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def pytest_sessionfinish(self, session):
+        if not self.profiles:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for nodeid, profile in self.profiles.items():
+            profile.dump_stats(self.path(nodeid))
+
+    def pytest_terminal_summary(self, terminalreporter):
+        terminalreporter.section("probtest cprofile")
+        if not self.profiles:
+            terminalreporter.line("No tests were profiled")
+            return
+        terminalreporter.line("Profiles written to "+str(self.directory))
+        for nodeid, profile in self.profiles.items():
+            terminalreporter.line("")
+            terminalreporter.line(nodeid+":")
+            for line in self.top(profile):
+                terminalreporter.line("    "+line)
+
+    def is_selected(self, item):
+        """Returns whether item matches the expression of
+        --probtest-cprofile-select and is not run concurrently, decided
+        once for all repeats of a test."""
+
+        nodeid = probtest.original_nodeid(item)
+        if nodeid not in self.selected:
+            selected = self.select is None or self.select.evaluate(KeywordMatcher.from_item(item))
+            if selected and probtest.concurrent(item):
+                item.warn(pytest.PytestWarning(
+                    "--probtest-cprofile does not profile repeats run concurrently"))
+                selected = False
+            self.selected[nodeid] = selected
+        return self.selected[nodeid]
+
+    def path(self, nodeid):
+        """Returns the path of the statistics of the test nodeid."""
+        return self.directory / (re.sub(r"[^\w.-]+", "_", nodeid)+".prof")
+
+    def top(self, profile, n=TOP):
+        """Returns the lines of a table of the n functions with the most
+        time of their own in profile."""
+
+        stats = pstats.Stats(profile).stats
+        functions = sorted(stats.items(), key=lambda entry: entry[1][2], reverse=True)
+        table = [("function", "calls", "own time", "cumulative")]
+        for function, (_, calls, own, cumulative, _) in functions[:n]:
+            table.append((pstats.func_std_string(function), str(calls),
+                          "%.4fs" % own, "%.4fs" % cumulative))
+        return align(table)
+
+def start(config, directory, select=None):
+    """Registers the profiler, profiling the tests matching the keyword
+    expression select, or all tests if it is None. Warns instead if the
+    repeats are run in other processes.
+
+    Raises:
+        ValueError: When select is not a valid keyword expression.
+    """
+
+    try:
+        expression = Expression.compile(select) if select is not None else None
+    except ParseError as e:
+        raise ValueError(str(e)) from None
+    for option in ('probtest_workers', 'probtest_fork'):
+        if config.getoption(option):
+            config.issue_config_time_warning(pytest.PytestConfigWarning(
+                "--probtest-cprofile does not profile the repeats run by --"
+                +option.replace("_", "-")+" in other processes"), stacklevel=2)
+            return
+    config.pluginmanager.register(CProfiler(directory, expression), "probtest_cprofile")
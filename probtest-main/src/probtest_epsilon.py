@@ -0,0 +1,62 @@
+"""Allocation of a global epsilon over the tests for the probtest plugin.
+
+With --probtest-global-epsilon E, the probability that any test of the
+session misses an outcome is bounded by E through the union bound: test i
+gets epsilon_i with sum(epsilon_i) = E. Missing an outcome of probability
+pmin_i after k_i repeats has probability about (1-pmin_i)^k_i, so k_i grows
+as log(1/epsilon_i)/-log(1-pmin_i), and the total time sum(cost_i*k_i) is
+minimised for epsilon_i proportional to cost_i/-log(1-pmin_i), where cost_i
+is the time of a repeat of test i measured in earlier sessions and stored
+in .pytest_cache, rounded to a power of two. Tests without a measured cost
+are given the mean cost of the others.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import math
+
+CACHE_KEY = "probtest/costs"
+
+def allocate(epsilon, tests):
+    """Splits epsilon over the tests, given as pairs of the cost of a
+    repeat, or None if it is not known, and the probability of the least
+    likely outcome, below 1.
+
+    Returns:
+        The epsilon of each test, rounded down to two significant digits so
+        that the number of repeats is computed for few distinct values.
+    """
+
+    costs = [quantise(cost) if cost is not None else None for cost, _ in tests]
+    known = [cost for cost in costs if cost is not None]
+    default = sum(known)/len(known) if known else 1.0
+    weights = [(cost if cost is not None else default)/-math.log1p(-pmin)
+               for cost, (_, pmin) in zip(costs, tests)]
+    total = sum(weights)
+    return [round_down(epsilon*weight/total) for weight in weights]
+
+def quantise(cost):
+    """Rounds the cost to the nearest power of two, so that the noise in the
+    costs measured in different sessions rarely changes the epsilons, and
+    thus the number of repeats, of the tests."""
+
+    return 2.0**round(math.log2(max(cost, 1e-9)))
+
+def round_down(value):
+    """Rounds the positive value down to two significant digits."""
+
+    digits = 1-math.floor(math.log10(value))
+    return math.floor(value*10**digits+1e-9)/10**digits
+
+def load(config):
+    """Returns the stored costs of a repeat in seconds, keyed by node id."""
+
+    cache = getattr(config, "cache", None)
+    return cache.get(CACHE_KEY, {}) if cache is not None else {}
+
+def store(config, costs):
+    """Stores the costs in .pytest_cache."""
+
+    cache = getattr(config, "cache", None)
+    if cache is not None:
+        cache.set(CACHE_KEY, costs)
@@ -0,0 +1,204 @@
+"""Fixtures of concurrent repeats for the probtest plugin.
+
+When the repeats of a test are run concurrently with --probtest-threads or
+--probtest-async-concurrency, the fixtures of the test are set up once by
+pytest, except for the function scoped fixtures defined in the test modules
+and conftest files, which usually draw the sample of the program under
+test. These are set up for each repeat, in the thread or task running it,
+and torn down after it, so that every repeat draws its own sample, as when
+the repeats are run one after another. Async fixtures are awaited by
+repeats of async tests.
+
+Function scoped fixtures of pytest, probtest and other plugins are set up
+once and shared by the repeats.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import inspect
+import sys
+
+import pytest
+from _pytest.fixtures import resolve_fixture_function
+
+import probtest_certify
+
+# The value of a fixture set up for each repeat in the setup of the test
+UNSET = object()
+
+# The names of the fixtures of a test set up for each repeat, in an order
+# in which they can be set up
+repeated_key = pytest.StashKey[list]()
+
+def repeated(item):
+    """Returns the names of the fixtures of item set up for each repeat,
+    with the fixtures each depends on before it."""
+
+    if repeated_key not in item.stash:
+        definitions = item._fixtureinfo.name2fixturedefs
+        root = item.config.rootpath.resolve()
+        names = []
+        def visit(name):
+            if name in names or name not in definitions:
+                return
+            fixturedef = definitions[name][-1]
+            if fixturedef.scope != "function" or not local(fixturedef, root):
+                return
+            for argname in fixturedef.argnames:
+                visit(argname)
+            names.append(name)
+        for name in item._fixtureinfo.names_closure:
+            visit(name)
+        item.stash[repeated_key] = names
+    return item.stash[repeated_key]
+
+def shared(item):
+    """Returns the values of the fixtures set up once that the test function
+    of item or the fixtures set up for each repeat take."""
+
+    names = repeated(item)
+    definitions = item._fixtureinfo.name2fixturedefs
+    arguments = set(item._fixtureinfo.argnames)
+    for name in names:
+        arguments.update(argname for argname in definitions[name][-1].argnames if argname != "request")
+    return {name: item.funcargs[name] for name in arguments
+            if name not in names and name in item.funcargs}
+
+def local(fixturedef, root):
+    """Returns whether fixturedef is defined in a test module or conftest
+    file under root, rather than by pytest or a plugin."""
+
+    module = sys.modules.get(getattr(fixturedef.func, "__module__", None))
+    if module is None or module.__name__.startswith("probtest"):
+        return False
+    return probtest_certify.local_file(module, root) is not None
+
+class RepeatRequest:
+    """The request of a fixture set up for one repeat: the request of the
+    test, with the parameter of the fixture and finalizers that are run
+    after the repeat."""
+
+    def __init__(self, repeat, fixturedef):
+        self._repeat = repeat
+        self.fixturename = fixturedef.argname
+        callspec = getattr(repeat.item, "callspec", None)
+        if callspec is not None and fixturedef.argname in callspec.params:
+            self.param = callspec.params[fixturedef.argname]
+
+    def addfinalizer(self, finalizer):
+        self._repeat.finalizers.append(finalizer)
+
+    def getfixturevalue(self, name):
+        return self._repeat.values[name]
+
+    def __getattr__(self, name):
+        return getattr(self._repeat.item._request, name)
+
+class Repeat:
+    """The fixture values of one repeat of a test: the given values of the
+    fixtures set up once, and those set up for the repeat."""
+
+    def __init__(self, item, values):
+        self.item = item
+        self.values = dict(values)
+        self.finalizers = []
+
+    def funcargs(self):
+        """Returns the arguments of the test function."""
+        return {name: self.values[name] for name in self.item._fixtureinfo.argnames}
+
+    def call(self, name):
+        """Calls the function of the fixture name with its arguments."""
+
+        fixturedef = self.item._fixtureinfo.name2fixturedefs[name][-1]
+        request = RepeatRequest(self, fixturedef)
+        function = resolve_fixture_function(fixturedef, self.item._request)
+        return function(**{argname: request if argname == "request" else self.values[argname]
+                           for argname in fixturedef.argnames})
+
+    def setup(self):
+        """Sets up the fixtures of the repeat."""
+
+        for name in repeated(self.item):
+            result = self.call(name)
+            if inspect.isgenerator(result):
+                self.values[name] = first(name, result)
+                self.finalizers.append(lambda name=name, result=result: last(name, result))
+            elif inspect.iscoroutine(result) or inspect.isasyncgen(result):
+                if inspect.iscoroutine(result):
+                    result.close()
+                pytest.fail("The async fixture "+name+" can only be used by async tests.", pytrace=False)
+            else:
+                self.values[name] = result
+
+    async def setup_async(self):
+        """Sets up the fixtures of the repeat, awaiting async fixtures."""
+
+        for name in repeated(self.item):
+            result = self.call(name)
+            if inspect.isgenerator(result):
+                self.values[name] = first(name, result)
+                self.finalizers.append(lambda name=name, result=result: last(name, result))
+            elif inspect.isasyncgen(result):
+                try:
+                    self.values[name] = await result.__anext__()
+                except StopAsyncIteration:
+                    raise ValueError(name+" did not yield a value") from None
+                self.finalizers.append(lambda name=name, result=result: last_async(name, result))
+            elif inspect.iscoroutine(result):
+                self.values[name] = await result
+            else:
+                self.values[name] = result
+
+    def teardown(self):
+        """Runs the finalizers of the repeat, raising the first error."""
+
+        error = None
+        while self.finalizers:
+            try:
+                self.finalizers.pop()()
+            except BaseException as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    async def teardown_async(self):
+        """Runs the finalizers of the repeat, awaiting those of async
+        fixtures, raising the first error."""
+
+        error = None
+        while self.finalizers:
+            try:
+                result = self.finalizers.pop()()
+                if inspect.isawaitable(result):
+                    await result
+            except BaseException as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+def first(name, generator):
+    """Returns the value yielded by a generator fixture."""
+
+    try:
+        return next(generator)
+    except StopIteration:
+        raise ValueError(name+" did not yield a value") from None
+
+def last(name, generator):
+    """Runs a generator fixture to its end."""
+
+    try:
+        next(generator)
+    except StopIteration:
+        return
+    pytest.fail("The fixture "+name+" has more than one yield.", pytrace=False)
+
+async def last_async(name, generator):
+    """Runs an async generator fixture to its end."""
+
+    try:
+        await generator.__anext__()
+    except StopAsyncIteration:
+        return
+    pytest.fail("The fixture "+name+" has more than one yield.", pytrace=False)
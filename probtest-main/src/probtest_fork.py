@@ -0,0 +1,118 @@
+"""Forked repeats for the probtest plugin.
+
+With --probtest-fork, the fixtures of a test are set up once in the pytest
+process, after which its function scoped fixtures are torn down again. Each
+batch of repeats is then run in a child process forked from that state, so
+that the child inherits the fixtures of higher scopes copy-on-write and any
+change a repeat makes to global or session state is discarded with the
+child. The child sends the outcome of its batch to the pytest process
+through a pipe, and the test stops at the first batch that stops it.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import os
+import pickle
+
+import pytest
+from _pytest.runner import call_and_report
+
+import probtest
+import probtest_parallel
+
+def run_forked(item, repeats):
+    """Runs the given repeats of item in child processes, each running a
+    batch of repeats of the size given with --probtest-fork.
+
+    Returns:
+        The index of the repeat that decided the verdict, the total number
+        of repeats run by the children, and the reports of that repeat, as
+        returned by probtest_parallel.merge.
+    """
+
+    item.stash[probtest.repeat_key] = repeats[0]
+    reports = prepare(item)
+    if reports is not None:
+        return repeats[0], 1, reports
+
+    size = item.config.getoption('probtest_fork')
+    results = []
+    for start in range(0, len(repeats), size):
+        results.append(run_child(item, repeats[start:start+size]))
+        # The next child inherits the outcomes observed by this one.
+        if probtest_parallel.add_outcomes(item, results[-1]) or results[-1][2] is not None:
+            break
+    return probtest_parallel.merge(item, repeats, results)
+
+def prepare(item):
+    """Sets up the fixtures of item and tears down those of function scope,
+    so that the children inherit the fixtures of higher scopes.
+
+    Returns:
+        The reports of the setup and teardown if either failed, and
+        otherwise None.
+    """
+
+    try:
+        reports = [call_and_report(item, "setup", log=False)]
+        reports.append(call_and_report(item, "teardown", log=False, nextitem=item.parent))
+    finally:
+        # As at the end of runtestprotocol, so that the children set up the
+        # function scoped fixtures with a new request.
+        item._request = False
+        item.funcargs = None
+    return reports if any(report.failed for report in reports) else None
+
+def run_child(item, repeats):
+    """Runs the given repeats of item in a child process forked from this
+    process, and returns the result of probtest_parallel.run_isolated that
+    the child sends through a pipe."""
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        status = 1
+        try:
+            probtest_parallel.restart_capture(item.config)
+            data = pickle.dumps(probtest_parallel.run_isolated(item, repeats))
+            with os.fdopen(write, "wb") as pipe:
+                pipe.write(data)
+            status = 0
+        finally:
+            # Exits without the cleanup of the pytest process, such as the
+            # teardown of its fixtures and the flushing of its buffers.
+            os._exit(status)
+
+    os.close(write)
+    with os.fdopen(read, "rb") as pipe:
+        data = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    if data:
+        return pickle.loads(data)
+    return crashed(item, repeats, os.waitstatus_to_exitcode(status))
+
+def crashed(item, repeats, code):
+    """Returns a result as of probtest_parallel.run_isolated with a failed
+    report for the given repeats of item, run by a child process that
+    exited with code without sending a result."""
+
+    config = item.config
+    def raise_error():
+        raise RuntimeError("the child process running repeats "+str(repeats.start)+" to "
+                           +str(repeats.stop-1)+" exited with code "+str(code))
+    item.stash[probtest.repeat_key] = repeats.start
+    # The seed of the repeat that crashed is not known to this process.
+    if probtest.seed_key in item.stash:
+        del item.stash[probtest.seed_key]
+    call = pytest.CallInfo.from_call(raise_error, when="call")
+    report = item.ihook.pytest_runtest_makereport(item=item, call=call)
+    config.stash[probtest.stopped_key].pop(probtest.original_test(item), None)
+    reason = ("repeat "+str(repeats.start) if len(repeats)==1 else
+              "repeats "+str(repeats.start)+" to "+str(repeats.stop-1))+" failed"
+    data = config.hook.pytest_report_to_serializable(config=config, report=report)
+    durations = None
+    if probtest.durations_key in item.stash:
+        import probtest_aggregate
+        durations = probtest_aggregate.durations()
+    return repeats.start, len(repeats), reason, [data], durations, None
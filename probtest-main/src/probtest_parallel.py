@@ -0,0 +1,360 @@
+"""Process-parallel repeats for the probtest plugin.
+
+With --probtest-workers n, the k repeats of a test are split into chunks
+that are run by a pool of n worker processes. The workers are forked from
+the pytest process after collection, so they share its collected items and
+each keeps its own fixtures of higher scopes alive between chunks. The
+reports of the chunks are merged into one verdict: the test fails with the
+first failing repeat found, and the remaining chunks are cancelled once a
+worker has stopped the test.
+
+A worker is replaced by a new worker forked from the pytest process once
+it has run --probtest-recycle-repeats repeats, or once its peak memory has
+grown by --probtest-recycle-memory MiB, so that state leaked by repeats,
+such as registrations in global registries, is discarded. The pytest
+process has already imported the test modules, their dependencies and the
+modules given with --probtest-preload, so a new worker starts warm.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import importlib
+import itertools
+import math
+import multiprocessing
+import resource
+import sys
+from multiprocessing.connection import wait
+
+import pytest
+
+import probtest
+
+pool_key = pytest.StashKey["Pool"]()
+
+CHUNKS_PER_WORKER = 4
+JOIN_TIMEOUT = 60.0
+
+# Set in the pytest process before the workers are forked.
+config = None
+items = {}
+cancelled = None
+tests = itertools.count()
+
+class BrokenWorker(RuntimeError):
+    """A worker process exited without sending the result of its chunk of
+    repeats."""
+
+    def __init__(self, message, repeats):
+        super().__init__(message)
+        self.repeats = repeats
+
+class Worker:
+    """A worker process and the connection to it."""
+
+    def __init__(self, context):
+        self.connection, connection = context.Pipe()
+        self.process = context.Process(target=serve, args=(connection,), daemon=True)
+        self.process.start()
+        connection.close()
+        self.repeats = 0
+
+    def stop(self):
+        """Stops the worker after it has torn down its fixtures, killing it
+        if it does not exit in time."""
+
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.connection.close()
+        self.process.join(JOIN_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+class Pool:
+    """A pool of worker processes forked from the pytest process, which 
+    forks a new worker in place of one that is due to be recycled."""
+
+    def __init__(self, context, size, recycle_repeats=0, recycle_memory=0):
+        self.context = context
+        self.workers = [None]*size
+        self.recycle_repeats = recycle_repeats
+        self.recycle_memory = recycle_memory
+
+    def run(self, item, chunks, test):
+        """Runs the chunks of repeats of item in the workers, and no more
+        chunks once one has stopped the test or, with 
+        --probtest-stop-on-coverage, once the workers have observed all its
+        outcomes together.
+
+        Returns:
+            The results of run_chunk of the chunks that were run, in order.
+
+        Raises:
+            BrokenWorker: if a worker exited while running a chunk.
+        """
+
+        pending = list(enumerate(chunks))
+        results = {}
+        busy = {}
+        stopped = False
+        while busy or (pending and not stopped):
+            for slot in range(len(self.workers)):
+                if not pending or stopped:
+                    break
+                worker = self.workers[slot]
+                if worker is not None and worker.connection in busy:
+                    continue
+                index, chunk = pending.pop(0)
+                if worker is not None and self.recycle_repeats and (
+                        worker.repeats+len(chunk) > self.recycle_repeats):
+                    worker.stop()
+                    worker = None
+                if worker is None:
+                    worker = self.workers[slot] = Worker(self.context)
+                worker.connection.send((item.nodeid, chunk, test, outcomes(item)))
+                worker.repeats += len(chunk)
+                busy[worker.connection] = slot, index
+
+            for connection in wait(list(busy)):
+                slot, index = busy.pop(connection)
+                worker = self.workers[slot]
+                try:
+                    results[index], growth = connection.recv()
+                except EOFError:
+                    worker.process.join()
+                    raise BrokenWorker("a worker process exited with code "
+                                       +str(worker.process.exitcode)+" while running the test",
+                                       chunks[index])
+                stopped = stopped or results[index][2] is not None
+                if add_outcomes(item, results[index]):
+                    # All outcomes have been observed by the workers together.
+                    stopped = True
+                    cancelled.value = test
+                if self.recycle_memory and growth >= self.recycle_memory*2**20:
+                    worker.stop()
+                    self.workers[slot] = None
+        return [results[index] for index in sorted(results)]
+
+    def shutdown(self):
+        """Stops the workers."""
+
+        for worker in self.workers:
+            if worker is not None:
+                worker.stop()
+        self.workers = [None]*len(self.workers)
+
+def get_pool(session):
+    """Returns the pool of worker processes, which is created the first
+    time a test is run in parallel."""
+
+    global config, items, cancelled
+
+    if pool_key not in session.config.stash:
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise pytest.UsageError("--probtest-workers requires the fork start method")
+        config = session.config
+        items = {item.nodeid: item for item in session.items}
+        context = multiprocessing.get_context('fork')
+        cancelled = context.Value('q', -1)
+        pool = Pool(context, config.getoption('probtest_workers'),
+                    config.getoption('probtest_recycle_repeats'),
+                    config.getoption('probtest_recycle_memory'))
+        config.stash[pool_key] = pool
+        config.add_cleanup(pool.shutdown)
+    return session.config.stash[pool_key]
+
+def preload(names):
+    """Imports the modules with the given names into the pytest process,
+    from which the workers are forked."""
+
+    for name in names:
+        importlib.import_module(name)
+
+def peak_memory():
+    """Returns the peak resident memory of this process in bytes."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak*1024
+
+def serve(connection):
+    """Runs the chunks received from the pytest process in a worker, and 
+    sends back their results with the growth of its peak memory."""
+
+    restart_capture(config)
+    baseline = peak_memory()
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        result = run_chunk(*task)
+        connection.send((result, peak_memory()-baseline))
+    teardown()
+
+def teardown():
+    """Tears down the fixtures that the worker has set up before it exits
+    or is recycled."""
+
+    try:
+        next(iter(items.values())).session._setupstate.teardown_exact(None)
+    except Exception as e:
+        sys.stderr.write("probtest: a worker failed to tear down its fixtures: "+repr(e)+"\n")
+
+def restart_capture(config):
+    """Restarts the capture of output in a forked process, so that it does
+    not share the temporary capture files of the pytest process."""
+
+    capman = config.pluginmanager.getplugin("capturemanager")
+    if capman is not None and capman.is_globally_capturing():
+        capman.stop_global_capturing()
+        capman.start_global_capturing()
+        capman.suspend_global_capture()
+
+def run_chunk(nodeid, repeats, test, observed):
+    """Runs a chunk of repeats of a test in a worker process, given the
+    outcomes observed so far, and cancels the other chunks of the test if
+    it is stopped."""
+
+    item = items[nodeid]
+    # Tears down the fixtures left by the last test run by this worker.
+    try:
+        item.session._setupstate.teardown_exact(item)
+    except Exception:
+        pass
+
+    result = run_isolated(item, repeats, cancelled=lambda: cancelled.value == test, observed=observed)
+    if result[2] is not None:
+        cancelled.value = test
+    return result
+
+def run_isolated(item, repeats, cancelled=lambda: False, observed=None):
+    """Runs the given repeats of item in a process forked from the pytest
+    process, to be merged by merge in the pytest process. If observed is
+    not None, it replaces the outcomes of item observed in this process.
+
+    Returns:
+        The index of the last repeat run, the number of repeats run, the
+        reason the test was stopped or None, the serialised reports of
+        the last repeat run, with --probtest-aggregate, the durations
+        of the repeats run, and with --probtest-stop-on-coverage, the
+        outcomes observed.
+    """
+
+    config = item.config
+    if observed is not None:
+        config.stash[probtest.outcomes_key][probtest.original_test(item)] = set(observed)
+    if config.getoption('probtest_aggregate'):
+        import probtest_aggregate
+        item.stash[probtest.durations_key] = probtest_aggregate.durations()
+    i, runs, reports = probtest.run_repeats(item, repeats, cancelled=cancelled)
+
+    reason = config.stash[probtest.stopped_key].pop(probtest.original_test(item), None)
+    data = [config.hook.pytest_report_to_serializable(config=config, report=report)
+            for report in reports]
+    return (i, runs, reason, data, item.stash.get(probtest.durations_key, None),
+            outcomes(item))
+
+def outcomes(item):
+    """Returns the outcomes of item observed in this process with 
+    --probtest-stop-on-coverage, or None without it."""
+
+    config = item.config
+    if not config.getoption('probtest_stop_on_coverage'):
+        return None
+    return set(config.stash[probtest.outcomes_key].get(probtest.original_test(item), ()))
+
+def add_outcomes(item, result):
+    """Adds the outcomes observed by the process that returned result to
+    those of item, and returns whether all outcomes of item are observed."""
+
+    if result[5] is None:
+        return False
+    observed = item.config.stash[probtest.outcomes_key].setdefault(probtest.original_test(item), set())
+    observed |= result[5]
+    return len(observed) >= item.stash[probtest.n_key]
+
+def chunks(repeats, workers, limit=0):
+    """Splits the range of repeats into chunks for the workers, of at most
+    limit repeats if limit is positive."""
+
+    size = max(1, math.ceil(len(repeats)/(workers*CHUNKS_PER_WORKER)))
+    if limit:
+        size = min(size, limit)
+    return [repeats[start:start+size] for start in range(0, len(repeats), size)]
+
+def run_in_workers(item, repeats):
+    """Runs the given repeats of item in the pool of worker processes.
+
+    Returns:
+        The index of the repeat that decided the verdict, the total number
+        of repeats run by the workers, and the reports of that repeat, as
+        returned by merge.
+    """
+
+    pool = get_pool(item.session)
+    test = next(tests)
+    try:
+        results = pool.run(item, chunks(repeats, len(pool.workers), pool.recycle_repeats), test)
+    except BrokenWorker as e:
+        pool.shutdown()
+        del config.stash[pool_key]
+        return broken(item, e)
+    return merge(item, repeats, results)
+
+def broken(item, error):
+    """Returns the first repeat of the chunk of item that broke a worker
+    with error, no runs and a failed report of the chunk, as the repeats of
+    the chunk that the worker ran are not known."""
+
+    def raise_error():
+        raise error
+    repeats = error.repeats
+    item.stash[probtest.repeat_key] = repeats.start
+    # The seed of the repeat that broke the worker is not known to this process.
+    if probtest.seed_key in item.stash:
+        del item.stash[probtest.seed_key]
+    call = pytest.CallInfo.from_call(raise_error, when="call")
+    report = item.ihook.pytest_runtest_makereport(item=item, call=call)
+    item.config.stash[probtest.stopped_key][probtest.original_test(item)] = (
+        ("repeat "+str(repeats.start) if len(repeats)==1 else
+         "repeats "+str(repeats.start)+" to "+str(repeats.stop-1))+" failed")
+    return repeats.start, 0, [report]
+
+def merge(item, repeats, results):
+    """Merges the results of run_isolated for chunks of the given repeats
+    of item into one verdict: the test is stopped for the stop with the
+    lowest repeat index, such as the first failure, or else if the chunks
+    together observed all outcomes with --probtest-stop-on-coverage.
+
+    Returns:
+        The index of the repeat that decided the verdict, the total number
+        of repeats run, and the reports of that repeat.
+    """
+
+    config = item.config
+    runs = sum(result[1] for result in results)
+    stops = [result for result in results if result[2] is not None]
+    if stops:
+        i, _, reason, data, _, _ = min(stops, key=lambda result: result[0])
+        config.stash[probtest.stopped_key][probtest.original_test(item)] = reason
+    else:
+        i, _, reason, data, _, _ = max(results, key=lambda result: result[0] if result[1] else -1)
+        if any([add_outcomes(item, result) for result in results]):
+            observed = config.stash[probtest.outcomes_key][probtest.original_test(item)]
+            reason = "all "+str(len(observed))+" outcomes were observed"
+            config.stash[probtest.stopped_key][probtest.original_test(item)] = reason
+
+    durations = item.stash.get(probtest.durations_key, None)
+    if durations is not None:
+        for result in results:
+            durations.extend(result[4])
+
+    reports = [config.hook.pytest_report_from_serializable(config=config, data=d)
+               for d in data]
+    for report in reports:
+        probtest.record_result(config, probtest.original_nodeid(item), report)
+    if reason is not None and not any(report.failed for report in reports):
+        config.stash[probtest.saved_key].append((item.nodeid, reason, runs, len(repeats)))
+    return i, runs, reports
@@ -0,0 +1,151 @@
+"""Timing and memory profile of the repeats of tests for the probtest plugin.
+
+With --probtest-profile, the wall time, CPU time and tracemalloc peak of the
+setup, call and teardown of each repeat of each test are recorded in arrays,
+written to a JSON file in .pytest_cache, or to the file given with
+--probtest-profile-path, as NPZ if it ends with .npz, at the end of the
+session, and the slowest tests by total time of their repeats are listed.
+Only repeats run one after another in the pytest process are recorded,
+not those run by --probtest-workers or --probtest-fork in other processes,
+nor those run concurrently by --probtest-threads or
+--probtest-async-concurrency.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import json
+import time
+import tracemalloc
+from array import array
+from pathlib import Path
+
+import pytest
+
+import probtest
+from probtest_aggregate import align
+
+PHASES = ("setup", "call", "teardown")
+SLOWEST = 10
+
+class PhaseBuffer:
+    """The measurements of one phase of the repeats of a test."""
+
+    def __init__(self):
+        self.repeat = array('q')
+        self.wall = array('d')
+        self.cpu = array('d')
+        self.peak = array('q')
+
+    def append(self, repeat, wall, cpu, peak):
+        self.repeat.append(repeat)
+        self.wall.append(wall)
+        self.cpu.append(cpu)
+        self.peak.append(peak)
+
+    def fields(self):
+        return {"repeat": self.repeat, "wall": self.wall, "cpu": self.cpu, "peak": self.peak}
+
+class Profiler:
+    """A plugin that measures the phases of the repeats of tests."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tests = {}
+
+    def measure(self, item, phase):
+        """Returns a generator for a hook wrapper that measures phase."""
+
+        tracemalloc.reset_peak()
+        memory = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        wall, cpu = time.perf_counter()-wall, time.process_time()-cpu
+        # The peak is measured from the memory allocated before the phase.
+        peak = tracemalloc.get_traced_memory()[1]-memory
+        buffers = self.tests.setdefault(probtest.original_nodeid(item),
+                                        {name: PhaseBuffer() for name in PHASES})
+        buffers[phase].append(probtest.repeat_index(item), wall, cpu, peak)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item):
+        yield from self.measure(item, "setup")
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        yield from self.measure(item, "call")
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        yield from self.measure(item, "teardown")
+
+    def pytest_sessionfinish(self, session):
+        self.write()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        terminalreporter.section("probtest profile")
+        terminalreporter.line("Profile written to "+str(self.path))
+        for line in self.slowest():
+            terminalreporter.line(line)
+
+    def write(self):
+        """Writes the measurements to self.path, as NPZ if it ends with .npz
+        and otherwise as JSON."""
+
+        if str(self.path).endswith(".npz"):
+            import numpy
+            arrays = {nodeid+"/"+phase+"/"+field: numpy.array(values)
+                      for nodeid, buffers in self.tests.items()
+                      for phase, buffer in buffers.items()
+                      for field, values in buffer.fields().items()}
+            numpy.savez(self.path, **arrays)
+        else:
+            tests = {nodeid: {phase: {field: values.tolist() for field, values in buffer.fields().items()}
+                              for phase, buffer in buffers.items()}
+                     for nodeid, buffers in self.tests.items()}
+            with open(self.path, "w") as f:
+                json.dump({"phases": PHASES, "tests": tests}, f)
+
+    def slowest(self, n=SLOWEST):
+        """Returns the lines of a table of the n tests with the largest
+        total wall time of their repeats."""
+
+        rows = []
+        for nodeid, buffers in self.tests.items():
+            walls = [sum(buffers[phase].wall) for phase in PHASES]
+            repeats = len(buffers["setup"].repeat)
+            peak = max((max(buffers[phase].peak, default=0) for phase in PHASES))
+            cpu = sum(sum(buffers[phase].cpu) for phase in PHASES)
+            rows.append((sum(walls), nodeid, repeats, walls, cpu, peak))
+        rows.sort(reverse=True)
+
+        table = [("slowest tests", "repeats", "total", "setup", "call", "teardown", "cpu", "peak memory")]
+        for total, nodeid, repeats, walls, cpu, peak in rows[:n]:
+            table.append((nodeid, str(repeats), "%.4fs" % total, *("%.4fs" % wall for wall in walls),
+                          "%.4fs" % cpu, "%.1f KiB" % (peak/1024)))
+        return align(table)
+
+def start(config, path=None):
+    """Starts tracing memory allocations and registers the profiler, which
+    writes to path, or to a file in .pytest_cache if it is None.
+
+    Raises:
+        ValueError: When path is a Python file, which may be a test
+            module given as the path by mistake.
+    """
+
+    if path is None:
+        path = default_path(config)
+    elif Path(path).suffix == ".py":
+        raise ValueError("refusing to write the profile over the Python file "+str(path))
+    tracemalloc.start()
+    config.add_cleanup(tracemalloc.stop)
+    config.pluginmanager.register(Profiler(path), "probtest_profile")
+
+def default_path(config):
+    """Returns the path of the profile in .pytest_cache, or in the root
+    directory if the cache provider is disabled."""
+
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return config.rootpath / "probtest_profile.json"
+    return cache.mkdir("probtest") / "profile.json"
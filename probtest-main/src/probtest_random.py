@@ -0,0 +1,165 @@
+"""Detection of whether a test consumes randomness.
+
+Used by the probtest plugin to seed each repeat of a test, to run
+deterministic tests only once, and to give copies of random generators
+their own streams. A RandomnessProbe is started before a test is set up
+and stopped after it has been called. It detects randomness drawn from:
+    - the global state of random and numpy.random,
+    - instances of random.Random and scipy.stats distributions (rvs),
+    - numpy generators created with numpy.random.default_rng, or found in
+      the test's module or among the fixture values of the test.
+
+numpy and scipy are only instrumented if they have already been imported.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import copy
+import hashlib
+import pickle
+import random
+import sys
+
+class RandomnessProbe:
+    """Detects whether randomness is drawn between start() and stop()."""
+
+    def __init__(self):
+        self.draws = 0
+        self.restore = []
+        self.states = []
+
+    def start(self, objects=()):
+        """Starts counting draws of randomness and records the states of
+        the global random generators and of the generators among objects."""
+
+        self.watch([random])
+        for owner in (random.Random, random.SystemRandom):
+            self.patch(owner, 'random')
+            self.patch(owner, 'getrandbits')
+
+        numpy = sys.modules.get('numpy')
+        if numpy is not None:
+            self.watch([numpy.random])
+            self.patch(numpy.random, 'default_rng')
+
+        stats = sys.modules.get('scipy.stats._distn_infrastructure')
+        if stats is not None:
+            self.patch(stats.rv_generic, 'rvs')
+
+        self.watch(objects)
+
+    def watch(self, objects):
+        """Records the states of the generators among objects, which are
+        compared to their states when the probe is stopped."""
+
+        for obj in objects:
+            state = get_state(obj)
+            if state is not None:
+                self.states.append((obj, state))
+
+    def patch(self, owner, name):
+        """Replaces the function owner.name by one that counts its calls."""
+
+        original = getattr(owner, name)
+        own = name in vars(owner)
+
+        def counted(*args, **kwargs):
+            self.draws += 1
+            return original(*args, **kwargs)
+
+        setattr(owner, name, counted)
+        if own:
+            self.restore.append(lambda: setattr(owner, name, original))
+        else:
+            self.restore.append(lambda: delattr(owner, name))
+
+    def stop(self):
+        """Restores the instrumented functions and returns whether any
+        randomness was drawn since the probe was started."""
+
+        while self.restore:
+            self.restore.pop()()
+        changed = any(get_state(obj)!=state for obj, state in self.states)
+        return self.draws>0 or changed
+
+def derive_seed(base, nodeid, repeat):
+    """Returns the 64 bit seed of a repeat of the test nodeid, derived from
+    the base seed of the session with a hash, so that numpy is not imported
+    for it and the seed is the same whether or not numpy is loaded."""
+
+    digest = hashlib.blake2b(repr((base, nodeid, repeat)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def seed_globals(seed):
+    """Seeds the global random generators of random and, if it has been
+    imported, numpy.random."""
+
+    random.seed(seed)
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        numpy.random.seed(seed % 2**32)
+
+def global_states():
+    """Returns the states of the global random generators of random and, if
+    it has been imported, numpy.random, to be restored with
+    set_global_states."""
+
+    numpy = sys.modules.get('numpy')
+    return random.getstate(), numpy.random.get_state() if numpy is not None else None
+
+def set_global_states(states):
+    """Restores the states of the global random generators returned by
+    global_states."""
+
+    random.setstate(states[0])
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and states[1] is not None:
+        numpy.random.set_state(states[1])
+
+def copy_with_streams(values, seeds):
+    """Returns a dict of deep copies of the values in the dict values, in
+    which random generators are reseeded with seeds drawn from the
+    random.Random seeds. Values that cannot be copied are shared."""
+
+    copies = {}
+    for name, value in values.items():
+        try:
+            value = copy.deepcopy(value)
+        except Exception:
+            pass
+        copies[name] = reseed(value, seeds.getrandbits(64))
+    return copies
+
+def reseed(obj, seed):
+    """Seeds obj with seed if it is a random generator, and returns it."""
+
+    numpy = sys.modules.get('numpy')
+    if isinstance(obj, random.SystemRandom):
+        pass
+    elif isinstance(obj, random.Random):
+        obj.seed(seed)
+    elif numpy is not None and isinstance(obj, numpy.random.RandomState):
+        obj.seed(seed % 2**32)
+    elif numpy is not None and isinstance(obj, numpy.random.Generator):
+        obj.bit_generator.state = type(obj.bit_generator)(seed).state
+    return obj
+
+def get_state(obj):
+    """Returns the state of obj, serialised so that it can be compared, if
+    obj is a random generator or a module with a global random generator,
+    and otherwise None."""
+
+    numpy = sys.modules.get('numpy')
+    if isinstance(obj, random.SystemRandom):
+        return None
+    if obj is random or isinstance(obj, random.Random):
+        state = obj.getstate()
+    elif numpy is not None and obj is numpy.random:
+        state = numpy.random.get_state(legacy=False)
+    elif numpy is not None and isinstance(obj, numpy.random.RandomState):
+        state = obj.get_state(legacy=False)
+    elif numpy is not None and isinstance(obj, numpy.random.Generator):
+        state = obj.bit_generator.state
+    else:
+        return None
+    return pickle.dumps(state)
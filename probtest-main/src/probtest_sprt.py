@@ -0,0 +1,106 @@
+"""Sequential probability ratio tests for the probtest plugin.
+
+With --probtest-sprt p0,p1,alpha,beta, each failing repeat of a test is an
+observation of a bug, and Wald's sequential probability ratio test decides
+between H0: P(bug) <= p0 and H1: P(bug) >= p1 after each repeat. The test
+stops passing as soon as the log-likelihood ratio of the repeats falls to
+log(beta/(1-alpha)), and fails as soon as it rises to log((1-beta)/alpha),
+so that it passes a program with P(bug) <= p0 with probability at least
+1-alpha and fails a program with P(bug) >= p1 with probability at least
+1-beta. Failing repeats before that are tolerated. With p0 = 0, the first
+failing repeat fails the test, as without --probtest-sprt.
+
+The test is truncated after TRUNCATION times its larger expected number of
+repeats under H0 and H1, where it fails if the ratio favours H1.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import math
+
+TRUNCATION = 3
+
+class Sprt:
+    """Wald's test of H0: P(bug) <= p0 against H1: P(bug) >= p1 with the
+    error probabilities alpha and beta."""
+
+    def __init__(self, p0, p1, alpha, beta):
+        if not 0 <= p0 < p1 < 1:
+            raise ValueError("The bug probabilities must satisfy 0 <= p0 < p1 < 1.")
+        if not (0 < alpha and 0 < beta and alpha+beta < 1):
+            raise ValueError("The error probabilities must be positive and have a sum below 1.")
+        self.p0, self.p1, self.alpha, self.beta = p0, p1, alpha, beta
+        self.lower = math.log(beta/(1-alpha))
+        self.upper = math.log((1-beta)/alpha)
+        # The terms of the log-likelihood ratio for a failing and a passing repeat
+        self.bug = math.log(p1/p0) if p0 > 0 else math.inf
+        self.no_bug = math.log((1-p1)/(1-p0))
+        self.limit = math.ceil(TRUNCATION*max(self.expected_repeats(p0), self.expected_repeats(p1)))
+
+    def expected_repeats(self, p):
+        """Returns Wald's approximation of the expected number of repeats
+        when the bug probability is p0 or p1."""
+
+        if self.p0 == 0:
+            # Passes only, until the lower bound, or the first failure.
+            passes = math.ceil(self.lower/self.no_bug)
+            return passes if p == 0 else (1-(1-p)**passes)/p
+        accept = 1-self.alpha if p == self.p0 else self.beta
+        drift = p*self.bug+(1-p)*self.no_bug
+        return (accept*self.lower+(1-accept)*self.upper)/drift
+
+    def describe(self):
+        """Describes the test and its expected number of repeats."""
+
+        return ("SPRT of P(bug) <= "+str(self.p0)+" against P(bug) >= "+str(self.p1)
+                +" with alpha "+str(self.alpha)+" and beta "+str(self.beta)+": expected "
+                +"%.1f repeats if P(bug) = %s and %.1f if P(bug) = %s, at most %d"
+                % (self.expected_repeats(self.p0), self.p0, self.expected_repeats(self.p1),
+                   self.p1, self.limit))
+
+class Walk:
+    """The log-likelihood ratio of the repeats of a test run so far."""
+
+    def __init__(self, sprt):
+        self.sprt = sprt
+        self.ratio = 0.0
+        self.runs = 0
+        self.failures = 0
+
+    def observe(self, failed):
+        """Adds a repeat to the ratio.
+
+        Returns:
+            True if H1 is accepted, False if H0 is accepted, or None if
+            more repeats are needed.
+        """
+
+        self.runs += 1
+        self.failures += failed
+        self.ratio += self.sprt.bug if failed else self.sprt.no_bug
+        if self.ratio >= self.sprt.upper:
+            return True
+        if self.ratio <= self.sprt.lower:
+            return False
+        if self.runs >= self.sprt.limit:
+            return self.ratio > 0
+        return None
+
+    def describe(self, bug):
+        """Describes the decision bug of the test."""
+
+        return ("SPRT accepted P(bug) "+(">= "+str(self.sprt.p1) if bug else "<= "+str(self.sprt.p0))
+                +" after "+str(self.runs)+" repeats with "+str(self.failures)+" failing"
+                +(" (truncated)" if self.runs >= self.sprt.limit else ""))
+
+def parse(value):
+    """Returns the Sprt given as p0,p1,alpha,beta.
+
+    Raises:
+        ValueError: When the parameters are not valid.
+    """
+
+    parameters = value.split(",")
+    if len(parameters) != 4:
+        raise ValueError("Please provide --probtest-sprt as p0,p1,alpha,beta, e.g. 0,0.01,0.05,0.05")
+    return Sprt(*map(float, parameters))
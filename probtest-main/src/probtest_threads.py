@@ -0,0 +1,109 @@
+"""Thread-parallel repeats for the probtest plugin.
+
+With --probtest-threads n, the repeats of tests marked probtest_thread_safe
+are run concurrently by a pool of n threads, which suits programs that spend
+their time in code that releases the GIL, such as numpy kernels or I/O, and
+programs run on free-threaded builds of CPython. The fixtures of the test
+are set up once, and each thread calls the test function with its own deep
+copy of them, in which random generators are reseeded so that every thread
+draws from its own stream, except for the fixtures set up for each repeat
+by probtest_fixtures, which the thread sets up and tears down. Repeats are
+submitted in batches, and no further repeats are started once one has
+failed.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import random
+import sys
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import pytest
+
+import probtest
+import probtest_fixtures
+from probtest_fixtures import Repeat
+from probtest_random import copy_with_streams
+
+executor_key = pytest.StashKey[ThreadPoolExecutor]()
+
+REPEATS_PER_THREAD = 8
+
+def gil_enabled():
+    """Returns whether the interpreter runs with the global interpreter lock."""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+def get_executor(config):
+    """Returns the pool of threads, which is created the first time a test
+    is run in threads."""
+
+    if executor_key not in config.stash:
+        executor = ThreadPoolExecutor(config.getoption('probtest_threads'),
+                                      thread_name_prefix="probtest")
+        config.stash[executor_key] = executor
+        config.add_cleanup(lambda: executor.shutdown(cancel_futures=True))
+    return config.stash[executor_key]
+
+class ThreadCopies(threading.local):
+    """The fixture values of a test, copied when first used by a thread."""
+
+    def __init__(self, funcargs, seeds):
+        self.funcargs = copy_with_streams(funcargs, seeds)
+
+def call_in_threads(item):
+    """Calls the test function of item for the number of repeats stored in
+    item.stash[probtest.concurrent_key], replacing it by the number of repeats run. If a
+    repeat fails, its index is stored as the repeat of item and its
+    exception is raised."""
+
+    config = item.config
+    executor = get_executor(config)
+    k = item.stash[probtest.concurrent_key]
+    n = item.stash[probtest.n_key]
+    outcomes = config.stash[probtest.outcomes_key].get(probtest.original_test(item), ())
+    stop_on_coverage = config.getoption('probtest_stop_on_coverage')
+
+    funcargs = probtest_fixtures.shared(item)
+    copies = ThreadCopies(funcargs, random.Random(item.stash.get(probtest.seed_key, None)))
+    done = threading.Event()
+
+    def repeat(i):
+        if done.is_set():
+            return False
+        try:
+            fixtures = Repeat(item, copies.funcargs)
+            try:
+                fixtures.setup()
+                item.obj(**fixtures.funcargs())
+            finally:
+                fixtures.teardown()
+        except BaseException:
+            done.set()
+            raise
+        if stop_on_coverage and len(outcomes)>=n:
+            done.set()
+        return True
+
+    runs = 0
+    batch = config.getoption('probtest_threads')*REPEATS_PER_THREAD
+    for start in range(0, k, batch):
+        futures = [executor.submit(repeat, i) for i in range(start, min(start+batch, k))]
+        wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        ran = [not future.cancelled() and (future.exception() is not None or future.result())
+               for future in futures]
+        runs += sum(ran)
+        for i, future in enumerate(futures, start):
+            if not future.cancelled() and future.exception() is not None:
+                item.stash[probtest.concurrent_key] = runs
+                item.stash[probtest.repeat_key] = i
+                raise future.exception()
+        if done.is_set() or item.session.shouldstop:
+            break
+
+    item.stash[probtest.concurrent_key] = runs
+    item.stash[probtest.repeat_key] = runs-1
@@ -0,0 +1,25 @@
+"""Test suite for the lookup of precomputed values of k.
+
+Author: Katrine Christensen <katch@itu.dk>
+"""
+
+import sys
+sys.path.insert(1, './src')
+
+import ccp_table
+
+
+def test_table_is_up_to_date():
+    """The shipped table agrees with the solver."""
+    assert ccp_table.TABLE==ccp_table.precompute()
+
+def test_equivalent_specifications_share_key():
+    """--p 0.5,0.5, --minp 0.5 --N 2 and --Pbug 0.5 are the same specification."""
+    P, counts = ccp_table.group([0.5,0.5])
+    assert ccp_table.spec_key(0.05,P,counts)==ccp_table.spec_key(0.05,[0.5],[2])
+
+def test_key_is_independent_of_order():
+    assert ccp_table.spec_key(0.05,[0.9,0.1],[1,1])==ccp_table.spec_key(0.05,[0.1,0.9],[1,1])
+
+def test_lookup_missing_specification():
+    assert ccp_table.lookup(0.05,[0.3],[3]) is None
@@ -8,6 +8,7 @@ Author: Katrine Christensen <katch@itu.dk>
 """
 
 import sys
+import math
 from pathlib import Path
 sys.path.insert(1, './src')
 
@@ -66,3 +67,66 @@ def test_upper_bound_probabilities_length_smaller_than_N():
     """
     with pytest.raises(ValueError):
         ccp_upper_bound.ccp(0.05,3,[0.5,0.5])
+
+def test_upper_bound_probability_equal_to_0():
+    """An outcome with probability 0 can never be covered."""
+    with pytest.raises(ValueError):
+        ccp_upper_bound.ccp(0.05,2,[0.0,0.5])
+
+def linear_ccp(epsilon,N,P):
+    """Reference implementation: increments k one at a time."""
+    k = N
+    while sum((1-p)**k for p in P) >= epsilon:
+        k += 1
+    return k
+
+@pytest.mark.parametrize("epsilon", [0.5, 0.05, 0.01])
+@pytest.mark.parametrize("P", [
+    [1], [0.5,0.5], [0.1,0.9], [1/6]*6, [0.25]*3, [0.1,0.2,0.3,0.4], [0.01]*20,
+])
+def test_upper_bound_same_as_linear_search(epsilon,P):
+    """Bracketing and bisection finds the same k as a linear search."""
+    assert ccp_upper_bound.ccp(epsilon,len(P),P)==linear_ccp(epsilon,len(P),P)
+
+def test_upper_bound_large_N_small_p():
+    """Large output sets with tiny probabilities are solved quickly, i.e.,
+    without evaluating every k."""
+    N = 10000
+    k = ccp_upper_bound.ccp(0.05,N,[1E-5]*N)
+    P_not_covered = N*(1-1E-5)**k
+    assert P_not_covered < 0.05
+    assert N*(1-1E-5)**(k-1) >= 0.05
+
+def test_upper_bound_grouped_same_as_ungrouped():
+    """Grouping equal probabilities does not change k."""
+    assert ccp_upper_bound.ccp_grouped(0.05,[1/6],[6])==ccp_upper_bound.ccp(0.05,6,[1/6]*6)
+    assert ccp_upper_bound.ccp_grouped(0.05,[0.1,0.2],[2,4])==ccp_upper_bound.ccp(0.05,6,[0.1,0.1,0.2,0.2,0.2,0.2])
+
+def test_upper_bound_grouped_millions_of_outcomes():
+    """The cost of computing k does not depend on N for grouped outcomes."""
+    N = 5000000
+    k = ccp_upper_bound.ccp_grouped(0.05,[1E-7],[N])
+    assert N*(1-1E-7)**k < 0.05
+    assert N*(1-1E-7)**(k-1) >= 0.05
+
+def test_upper_bound_grouped_probabilities_sum_to_more_than_1():
+    with pytest.raises(ValueError):
+        ccp_upper_bound.ccp_grouped(0.05,[0.1],[11])
+
+def test_upper_bound_grouped_length_mismatch():
+    with pytest.raises(ValueError):
+        ccp_upper_bound.ccp_grouped(0.05,[0.1,0.2],[2])
+
+def test_upper_bound_single_bug_closed_form():
+    """For a tiny bug probability, k is the closed form solution of 
+    (1-Pbug)**k < epsilon, as the term Pbug**k vanishes."""
+    Pbug = 1E-7
+    k = ccp_upper_bound.ccp(0.05,2,[Pbug,1-Pbug])
+    assert k==math.ceil(math.log(0.05)/math.log1p(-Pbug))
+
+def test_upper_bound_tiny_probabilities_do_not_underflow():
+    """k grows as 1/p for tiny p, also when (1-p)**k underflows."""
+    k1 = ccp_upper_bound.ccp_grouped(0.05,[1E-12],[2])
+    k2 = ccp_upper_bound.ccp_grouped(0.05,[1E-13],[2])
+    assert k1 > 1E12
+    assert abs(k2/k1-10) < 1E-6
@@ -1,4 +1,11 @@
-import pytest
+import json
+import os
+import subprocess
+import sys
+
+# The runs of pytester that import numpy, e.g. to compute k with the solver,
+# are run in a subprocess, as numpy cannot be imported again once an
+# in-process run has unloaded it.
 
 ############## Testing input errors ##############
 def test_error_handling_01(pytester):
@@ -10,7 +17,7 @@ def test_error_handling_02(pytester):
     result.stdout.fnmatch_lines(['*Exit: Please provide*'])
 
 def test_error_handling_03(pytester):
-    result = pytester.runpytest('--probtest','--p','0.5,0.6')
+    result = pytester.runpytest_subprocess('--probtest','--p','0.5,0.6')
     result.stdout.fnmatch_lines(['*Exit: Probabilities must sum to ≤ 1*'])
 
 def test_error_handling_04(pytester):
@@ -26,21 +33,21 @@ def test_error_handling_06(pytester):
     result.stdout.fnmatch_lines(['*Exit: Please provide the number of possible outcomes N*'])
 
 def test_error_handling_07(pytester):
-    result = pytester.runpytest('--probtest','--minp','0.1','--N','11')
+    result = pytester.runpytest_subprocess('--probtest','--minp','0.1','--N','11')
     result.stdout.fnmatch_lines(['*Exit: Probabilities must sum to ≤ 1*'])
 
 
 ############## Testing correct number of repeats ##############
 def test_single_run_01(pytester):
-    result = pytester.runpytest('--probtest','--p','1')
+    result = pytester.runpytest_subprocess('--probtest','--p','1')
     result.stdout.fnmatch_lines(['Your tests are being run 1 times.'])
 
 def test_single_run_02(pytester):
-    result = pytester.runpytest('--probtest','--minp','1','--N','1')
+    result = pytester.runpytest_subprocess('--probtest','--minp','1','--N','1')
     result.stdout.fnmatch_lines(['Your tests are being run 1 times.'])
 
 def test_single_run_03(pytester):
-    result = pytester.runpytest('--probtest','--Pbug','1.0')
+    result = pytester.runpytest_subprocess('--probtest','--Pbug','1.0')
     result.stdout.fnmatch_lines(['Your tests are being run 1 times.'])
 
 def test_6_runs_01(pytester):
@@ -63,6 +70,10 @@ def test_29_runs_02(pytester):
     result = pytester.runpytest('--probtest','--Pbug','0.1')
     result.stdout.fnmatch_lines(['Your tests are being run 29 times.'])
 
+def test_many_runs_minp_large_N(pytester):
+    result = pytester.runpytest_subprocess('--probtest','--minp','1E-7','--N','1000000')
+    result.stdout.fnmatch_lines(['Your tests are being run 168112420 times.'])
+
 ##############  ##############
 def test_01(pytester):
     pytester.makepyfile(
@@ -202,4 +213,1498 @@ def test_verbose_03_multiple_tests(pytester):
         '*::test_f_02[[]4[]] SKIPPED*', 
         '*::test_f_02[[]5[]] SKIPPED*', 
         '*1 failed, 1 passed*',
-    ])
\ No newline at end of file
+    ])
+
+############## Testing caching of k ##############
+def test_k_cached_between_sessions(pytester):
+    pytester.runpytest_subprocess('--probtest','--p','0.3,0.3,0.4')
+    cached = pytester.path.joinpath('.pytest_cache','v','probtest','k').read_text()
+    assert '"0.05:0.3x2,0.4x1": 11' in cached
+
+def test_k_read_from_cache(pytester):
+    pytester.makefile('', **{'.pytest_cache/v/probtest/k': '{"0.05:0.3x2,0.4x1": 7}'})
+    result = pytester.runpytest('--probtest','--p','0.3,0.3,0.4')
+    result.stdout.fnmatch_lines(['Your tests are being run 7 times.'])
+
+############## Testing start-up cost ##############
+def test_import_does_not_load_numpy():
+    """Loading the plugin, as pytest does for every session through the
+    pytest11 entry point, must not import numpy or the solver."""
+    code = ("import sys, probtest; "+
+            "print([m for m in ('numpy','matplotlib','ccp_upper_bound') if m in sys.modules])")
+    result = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,check=True)
+    assert result.stdout.strip()=="[]"
+
+def test_precomputed_k_does_not_load_numpy(pytester):
+    pytester.makepyfile(
+        """
+        import random
+
+        def test_f():
+            assert random.random() < 1
+    """)
+    pytester.makeconftest(
+        """
+        import sys
+
+        def pytest_sessionfinish(session):
+            print("numpy imported:", "numpy" in sys.modules)
+    """)
+    result = pytester.runpytest_subprocess('--probtest','--Pbug','0.1','-s')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['*numpy imported: False*'])
+
+############## Testing single item mode ##############
+def test_single_item_01_pass(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        def test_f():
+            runs.append(1)
+            assert True
+
+        def test_runs():
+            assert len(runs)==6
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-single-item','-v')
+    result.stdout.fnmatch_lines([
+        '*::test_f PASSED*',
+        '*::test_runs PASSED*',
+        '*2 passed*',
+    ])
+
+def test_single_item_02_stops_at_first_failure(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        def test_f():
+            runs.append(1)
+            assert len(runs)<3
+
+        def test_runs():
+            assert len(runs)==3
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-single-item')
+    result.assert_outcomes(passed=1,failed=1)
+    result.stdout.fnmatch_lines(['*Failed in repeat 2 of 6*'])
+
+def test_single_item_03_fixture_scopes(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        setups = {"module": 0, "function": 0}
+
+        @pytest.fixture(scope="module")
+        def m():
+            setups["module"] += 1
+
+        @pytest.fixture
+        def f():
+            setups["function"] += 1
+
+        def test_f(m, f):
+            pass
+
+        def test_setups():
+            assert setups=={"module": 1, "function": 6}
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-single-item')
+    result.assert_outcomes(passed=2)
+
+def test_single_item_04_collects_one_item_per_test(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-single-item','--collect-only','-q')
+    result.stdout.fnmatch_lines(['*1 test collected*'])
+
+############## Testing skipping after a failure ##############
+def test_skip_after_failure_parametrized_test(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.parametrize("x", [1, 2])
+        def test_f(x):
+            assert x==1
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','-v')
+    result.stdout.fnmatch_lines([
+        '*::test_f[[]1-0[]] PASSED*',
+        '*::test_f[[]1-5[]] PASSED*',
+        '*::test_f[[]2-0[]] FAILED*',
+        '*::test_f[[]2-1[]] SKIPPED*',
+        '*::test_f[[]2-5[]] SKIPPED*',
+        '*1 failed, 1 passed*',
+    ])
+
+def test_skip_after_failure_without_fixture_setup(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        setups = []
+
+        @pytest.fixture
+        def f():
+            setups.append(1)
+
+        def test_f(f):
+            assert len(setups)<2
+
+        def test_setups():
+            assert len(setups)==2
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5')
+    result.assert_outcomes(passed=1,failed=1)
+
+############## Testing per-test specifications ##############
+def test_marker_overrides_command_line(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = {"marked": 0, "unmarked": 0}
+
+        @pytest.mark.probtest(Pbug=0.5)
+        def test_marked():
+            runs["marked"] += 1
+
+        def test_unmarked():
+            runs["unmarked"] += 1
+
+        def test_runs():
+            assert runs=={"marked": 6, "unmarked": 29}
+    """)
+
+    result = pytester.runpytest('--probtest','--Pbug','0.1','-p','no:cacheprovider')
+    result.assert_outcomes(passed=3)
+
+def test_marker_on_class_and_module(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        pytestmark = pytest.mark.probtest(p=[0.1, 0.9])
+
+        runs = {"class": 0, "module": 0}
+
+        @pytest.mark.probtest(minp=0.5, N=2)
+        class TestClass:
+            def test_class(self):
+                runs["class"] += 1
+
+        def test_module():
+            runs["module"] += 1
+
+        @pytest.mark.probtest(p="1")
+        def test_runs():
+            assert runs=={"class": 6, "module": 29}
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--Pbug','0.5','--probtest-single-item')
+    result.assert_outcomes(passed=3)
+
+def test_marker_epsilon(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        @pytest.mark.probtest(Pbug=0.5, epsilon=0.01)
+        def test_f():
+            runs.append(1)
+
+        @pytest.mark.probtest(Pbug=1)
+        def test_runs():
+            assert len(runs)==8
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--Pbug','0.5')
+    result.assert_outcomes(passed=2)
+
+def test_marker_invalid_specification(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.probtest(p=[0.5], Pbug=0.5)
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--Pbug','0.5')
+    result.stdout.fnmatch_lines(['*Please provide either p, minp or Pbug*'])
+
+############## Testing deterministic tests ##############
+def test_deterministic_marker(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        @pytest.mark.probtest_deterministic
+        def test_f():
+            runs.append(1)
+
+        def test_runs():
+            assert len(runs)==1
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5')
+    result.assert_outcomes(passed=2)
+
+def test_detect_deterministic(pytester):
+    pytester.makepyfile(
+        """
+        import random
+        import numpy as np
+        import pytest
+
+        runs = {"deterministic": 0, "random": 0, "numpy": 0, "generator": 0, "fixture": 0}
+        rng = np.random.default_rng()
+
+        @pytest.fixture
+        def coin():
+            return random.randint(0, 1)
+
+        def test_deterministic():
+            runs["deterministic"] += 1
+            assert 1+1==2
+
+        def test_random():
+            runs["random"] += 1
+            assert random.random() < 1
+
+        def test_numpy():
+            runs["numpy"] += 1
+            assert np.random.rand() < 1
+
+        def test_generator():
+            runs["generator"] += 1
+            assert rng.random() < 1
+
+        def test_fixture(coin):
+            runs["fixture"] += 1
+            assert coin in (0, 1)
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert runs=={"deterministic": 1, "random": 6, "numpy": 6, "generator": 6, "fixture": 6}
+    """)
+
+    for mode in ([], ['--probtest-single-item']):
+        result = pytester.runpytest_subprocess('--probtest','--p','0.5,0.5','--probtest-detect-deterministic',*mode)
+        result.assert_outcomes(passed=6)
+
+def test_detect_deterministic_verbose(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            assert True
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-detect-deterministic','-v')
+    result.stdout.fnmatch_lines([
+        '*::test_f[[]0[]] PASSED*',
+        '*::test_f[[]1[]] SKIPPED*',
+        '*1 passed*',
+    ])
+
+############## Testing stopping on coverage ##############
+def test_stop_on_coverage(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        def throw_die():
+            runs.append(1)
+            return len(runs)%6+1
+
+        def test_die(probtest_outcome):
+            o = throw_die()
+            probtest_outcome(o)
+            assert 1<=o<=6
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(runs)==6
+    """)
+
+    for mode in ([], ['--probtest-single-item']):
+        result = pytester.runpytest_subprocess('--probtest','--p','1/6,1/6,1/6,1/6,1/6,1/6',
+                                    '--probtest-stop-on-coverage','-v',*mode)
+        result.assert_outcomes(passed=2)
+        result.stdout.fnmatch_lines([
+            'Stopped 1 tests early, saving 21 runs.',
+            '*::test_die: ran 6 of 27 times as all 6 outcomes were observed',
+        ])
+
+def test_no_stop_on_coverage_by_default(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        def test_die(probtest_outcome):
+            runs.append(1)
+            probtest_outcome(len(runs)%6)
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(runs)==27
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','1/6,1/6,1/6,1/6,1/6,1/6')
+    result.assert_outcomes(passed=2)
+
+############## Testing parallel repeats ##############
+def test_workers_run_all_repeats(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import os
+
+        def test_f():
+            with open({str(log)!r}, "a") as f:
+                f.write(str(os.getpid())+"\\n")
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','2')
+    result.assert_outcomes(passed=1)
+    pids = log.read_text().split()
+    assert len(pids)==29
+    assert str(os.getpid()) not in pids
+
+def test_workers_report_first_failure(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import time
+
+        def test_f():
+            with open({str(log)!r}, "a") as f:
+                f.write("run\\n")
+            time.sleep(0.01)
+            assert False
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','2')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['Failed in repeat 0 of 29'])
+    assert len(log.read_text().split())<29
+
+def test_workers_keep_higher_scoped_fixtures(pytester):
+    log = pytester.path / "setups.log"
+    pytester.makepyfile(
+        f"""
+        import pytest
+
+        @pytest.fixture(scope="module")
+        def m():
+            with open({str(log)!r}, "a") as f:
+                f.write("setup\\n")
+
+        def test_f(m):
+            pass
+
+        def test_g(m):
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','2')
+    result.assert_outcomes(passed=2)
+    assert len(log.read_text().split())<=2
+
+def test_workers_recycled_after_repeats(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import os
+
+        registry = []
+
+        def test_f():
+            assert len(registry)<5
+            registry.append(1)
+            with open({str(log)!r}, "a") as f:
+                f.write(str(os.getpid())+"\\n")
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','2',
+                                '--probtest-recycle-repeats','5')
+    result.assert_outcomes(passed=1)
+    pids = log.read_text().split()
+    assert len(pids)==29
+    assert len(set(pids))>=6
+
+def test_workers_recycled_after_memory_growth(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import os
+
+        leak = []
+
+        def test_f():
+            leak.append(bytearray(8*2**20))
+            with open({str(log)!r}, "a") as f:
+                f.write(str(os.getpid())+"\\n")
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','1',
+                                '--probtest-recycle-memory','20')
+    result.assert_outcomes(passed=1)
+    pids = log.read_text().split()
+    assert len(pids)==29
+    assert len(set(pids))>1
+
+def test_workers_preload_modules(pytester):
+    log = pytester.path / "imports.log"
+    pytester.makepyfile(warm=f"""
+        with open({str(log)!r}, "a") as f:
+            f.write("import\\n")
+    """)
+    pytester.makepyfile(
+        """
+        def test_f():
+            import warm
+    """)
+    pytester.syspathinsert()
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','2',
+                                '--probtest-recycle-repeats','1','--probtest-preload','warm')
+    result.assert_outcomes(passed=1)
+    assert log.read_text().split()==["import"]
+
+def test_recycling_requires_workers(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-recycle-repeats','5')
+    result.stdout.fnmatch_lines(['*Please provide --probtest-workers to recycle or preload workers.*'])
+
+def test_workers_tear_down_fixtures(pytester):
+    log = pytester.path / "fixtures.log"
+    pytester.makepyfile(
+        f"""
+        import pytest
+
+        @pytest.fixture(scope="session")
+        def s():
+            with open({str(log)!r}, "a") as f:
+                f.write("setup\\n")
+            yield
+            with open({str(log)!r}, "a") as f:
+                f.write("teardown\\n")
+
+        def test_f(s):
+            pass
+    """)
+
+    for recycle in ('0', '5'):
+        log.write_text("")
+        result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-workers','2',
+                                    '--probtest-recycle-repeats',recycle)
+        result.assert_outcomes(passed=1)
+        lines = log.read_text().split()
+        assert lines.count("setup")>=2
+        assert lines.count("teardown")==lines.count("setup")
+
+def test_workers_merge_outcomes(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import probtest
+
+        def test_die(request, probtest_outcome):
+            with open({str(log)!r}, "a") as f:
+                f.write("run\\n")
+            probtest_outcome(probtest.repeat_index(request.node)%6)
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','1/6,1/6,1/6,1/6,1/6,1/6','--probtest-workers','2',
+                                '--probtest-stop-on-coverage','-v')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['*::test_die: ran * of 27 times as all 6 outcomes were observed'])
+    assert len(log.read_text().split())<=12
+
+def test_workers_report_broken_worker(pytester):
+    pytester.makepyfile(
+        """
+        import os
+
+        def test_f():
+            os._exit(3)
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','0.1,0.9','--probtest-workers','2')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['*a worker process exited with code 3 while running the test*',
+                                 'Failed in repeats * to * of 29'])
+
+############## Testing thread repeats ##############
+def test_threads_run_thread_safe_tests(pytester):
+    pytester.makepyfile(
+        """
+        import random
+        import threading
+        import pytest
+
+        draws = []
+        threads = set()
+        setups = []
+
+        @pytest.fixture(scope="module")
+        def rng():
+            setups.append(1)
+            return random.Random(0)
+
+        @pytest.mark.probtest_thread_safe
+        def test_f(rng):
+            draws.append(rng.random())
+            threads.add(threading.current_thread().name)
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(draws)==29
+            assert len(set(draws))==29
+            assert setups==[1]
+            assert all(name.startswith("probtest") for name in threads)
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-threads','2')
+    result.assert_outcomes(passed=2)
+
+def test_threads_set_up_function_fixtures_per_repeat(pytester):
+    pytester.makepyfile(
+        """
+        import random
+        import pytest
+
+        draws = []
+        teardowns = []
+
+        @pytest.fixture
+        def o():
+            yield random.random()
+            teardowns.append(1)
+
+        @pytest.mark.probtest_thread_safe
+        def test_f(o):
+            draws.append(o)
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(draws)==299
+            assert len(set(draws))==299
+            assert len(teardowns)==299
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.01,0.99','--probtest-threads','4')
+    result.assert_outcomes(passed=2)
+
+def test_threads_only_run_marked_tests(pytester):
+    pytester.makepyfile(
+        """
+        import threading
+        import pytest
+
+        threads = set()
+
+        def test_f():
+            threads.add(threading.current_thread().name)
+
+        @pytest.mark.probtest_deterministic
+        def test_main_thread():
+            assert threads=={threading.main_thread().name}
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-threads','2')
+    result.assert_outcomes(passed=2)
+
+def test_threads_stop_at_first_failure(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = []
+
+        @pytest.mark.probtest_thread_safe
+        def test_f():
+            runs.append(1)
+            assert len(runs)<3
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(runs)<=2*8
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.01,0.99','--probtest-threads','2')
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(['Failed in repeat * of 299'])
+    # The repeats share one seed, so no replay of the failing one is given.
+    result.stdout.no_fnmatch_line('*--probtest-replay*')
+
+############## Testing async repeats ##############
+def test_async_repeats_run_concurrently(pytester):
+    pytester.makepyfile(
+        """
+        import asyncio
+        import pytest
+
+        running = []
+        runs = []
+
+        async def test_f():
+            running.append(1)
+            await asyncio.sleep(0.01)
+            runs.append(len(running))
+            running.pop()
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(runs)==29
+            assert max(runs)==10
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-async-concurrency','10')
+    result.assert_outcomes(passed=2)
+
+def test_async_fixtures_per_repeat(pytester):
+    pytester.makepyfile(
+        """
+        import asyncio
+        import random
+        import pytest
+
+        draws = []
+        teardowns = []
+
+        @pytest.fixture
+        def o():
+            return random.random()
+
+        @pytest.fixture
+        async def delay(o):
+            await asyncio.sleep(0)
+            yield o
+            teardowns.append(1)
+
+        async def test_f(o, delay):
+            assert delay==o
+            draws.append(o)
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(draws)==299
+            assert len(set(draws))==299
+            assert len(teardowns)==299
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.01,0.99','--probtest-async-concurrency','10')
+    result.assert_outcomes(passed=2)
+
+def test_async_first_failure_cancels_others(pytester):
+    pytester.makepyfile(
+        """
+        import asyncio
+        import pytest
+
+        started = []
+        finished = []
+
+        async def test_f():
+            started.append(1)
+            if len(started)==3:
+                assert False
+            await asyncio.sleep(1)
+            finished.append(1)
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert len(started)==3
+            assert finished==[]
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-async-concurrency','4')
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(['Failed in repeat 2 of 29'])
+    result.stdout.no_fnmatch_line('*--probtest-replay*')
+
+############## Testing batch tests ##############
+def test_batch_draws_k_samples(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        sizes = []
+
+        @pytest.mark.probtest_batch(size=10)
+        def test_f(probtest_batch_size):
+            sizes.append(probtest_batch_size)
+            return [True]*probtest_batch_size
+
+        @pytest.mark.probtest_deterministic
+        def test_sizes():
+            assert sizes==[10, 10, 9]
+    """)
+
+    for mode in ([], ['--probtest-single-item']):
+        result = pytester.runpytest('--probtest','--p','0.1,0.9',*mode)
+        result.assert_outcomes(passed=2)
+
+def test_batch_reports_failing_sample(pytester):
+    pytester.makepyfile(
+        """
+        import numpy as np
+        import pytest
+
+        @pytest.mark.probtest_batch(size=10)
+        def test_f(probtest_batch_size):
+            return np.arange(probtest_batch_size) < 7
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','0.1,0.9','--probtest-single-item')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['*Failed: sample 7 failed', 'Failed in sample 7 of 29'])
+
+def test_batch_reports_failing_batch(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        calls = []
+
+        @pytest.mark.probtest_batch(size=10)
+        def test_f(probtest_batch_size):
+            calls.append(1)
+            assert len(calls)<2
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-single-item')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['Failed in batch 1 (samples 10 to 19) of 29'])
+
+def test_batch_size_requires_marker(pytester):
+    pytester.makepyfile(
+        """
+        def test_f(probtest_batch_size):
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9')
+    result.assert_outcomes(errors=1)
+
+############## Testing seeding and replay ##############
+def test_seeds_reproduce_session(pytester):
+    pytester.makepyfile(
+        """
+        import random
+
+        def test_f(probtest_rng):
+            print("draws", random.random(), probtest_rng.random())
+    """)
+
+    draws = []
+    for mode in ([], [], ['--probtest-single-item']):
+        result = pytester.runpytest_subprocess('--probtest','--p','0.5,0.5','--probtest-seed','7','-s',*mode)
+        result.assert_outcomes(passed=1)
+        draws.append([line[line.index("draws"):] for line in result.outlines if "draws" in line])
+    assert len(draws[0])==6
+    assert len(set(draws[0]))==6
+    assert draws[0]==draws[1]==draws[2]
+
+def test_seeds_differ_for_node_ids_with_same_crc():
+    import probtest_random
+    # Two node ids with the same CRC-32.
+    seeds = [probtest_random.derive_seed(7, nodeid, 0)
+             for nodeid in ("test_x.py::test_29685295", "test_x.py::test_32060020")]
+    assert seeds[0]!=seeds[1]
+
+def test_failure_reports_seed(pytester):
+    pytester.makepyfile(
+        """
+        runs = []
+
+        def test_f():
+            runs.append(1)
+            assert len(runs)<4
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-seed','7')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines([
+        "Seed *, replay with --probtest-seed 7 --probtest-replay 'test_failure_reports_seed.py::test_f@3'"])
+
+def test_replay_runs_one_repeat(pytester):
+    pytester.makepyfile(
+        """
+        import random
+
+        def test_f():
+            print("draw", random.random())
+
+        def test_g():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-seed','7','-s')
+    draw = [line[line.index("draw"):] for line in result.outlines if "draw" in line][4]
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-seed','7','-s',
+                                '--probtest-replay','test_replay_runs_one_repeat.py::test_f@4')
+    result.assert_outcomes(passed=1, deselected=1)
+    assert [line[line.index("draw"):] for line in result.outlines if "draw" in line]==[draw]
+
+def test_replay_invalid(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-replay','test_f')
+    result.stdout.fnmatch_lines(['*Please provide the repeat to replay as NODEID@INDEX*'])
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-replay','test_g@1')
+    result.stderr.fnmatch_lines(['*no test with node id test_g*'])
+
+############## Testing the failed seed store ##############
+def test_failed_seed_replayed_first(pytester):
+    pytester.makepyfile(
+        """
+        import random
+
+        def test_f():
+            assert random.random() < 0.8
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.01,0.99','--probtest-seed','1')
+    result.assert_outcomes(failed=1)
+    seeds = json.loads((pytester.path / ".pytest_cache/v/probtest/failed_seeds").read_text())
+    assert list(seeds)==["test_failed_seed_replayed_first.py::test_f"]
+    assert len(seeds["test_failed_seed_replayed_first.py::test_f"])==1
+
+    for mode in ([], ['--probtest-single-item']):
+        result = pytester.runpytest('--probtest','--p','0.01,0.99','--probtest-seed','2',*mode)
+        result.assert_outcomes(failed=1)
+        result.stdout.fnmatch_lines(['Seed * (failed in an earlier session), replay with *@0*'])
+
+def test_failed_seeds_forgotten_when_test_passes(pytester, monkeypatch):
+    pytester.makepyfile(
+        """
+        import os
+
+        def test_f():
+            assert not os.environ.get("PROBTEST_FAIL")
+    """)
+
+    monkeypatch.setenv("PROBTEST_FAIL", "1")
+    result = pytester.runpytest('--probtest','--p','0.5,0.5')
+    result.assert_outcomes(failed=1)
+    monkeypatch.delenv("PROBTEST_FAIL")
+    result = pytester.runpytest('--probtest','--p','0.5,0.5')
+    result.assert_outcomes(passed=1)
+    seeds = json.loads((pytester.path / ".pytest_cache/v/probtest/failed_seeds").read_text())
+    assert seeds=={}
+
+############## Testing incremental certification ##############
+def test_incremental_resumes_and_skips(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-budget','20')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['*::test_f: passed 20 of 29 repeats'])
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-budget','20','-rP')
+    result.assert_outcomes(passed=1)
+    result.stdout.no_fnmatch_line('*partially certified*')
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-incremental','-rs')
+    result.assert_outcomes(skipped=1)
+    result.stdout.fnmatch_lines(['*certified with 29 passing repeats in earlier sessions'])
+
+def test_incremental_reruns_changed_tests(pytester):
+    pytester.makepyfile(lib="def f():\n    return 1\n")
+    pytester.makepyfile(
+        """
+        from lib import f
+
+        def test_f():
+            assert f()==1
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-incremental')
+    result.assert_outcomes(passed=1)
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-incremental')
+    result.assert_outcomes(skipped=1)
+    result = pytester.runpytest('--probtest','--p','0.2,0.8','--probtest-incremental')
+    result.assert_outcomes(passed=1)
+
+    pytester.makepyfile(lib="def f():\n    return 2\n")
+    result = pytester.runpytest('--probtest','--p','0.2,0.8','--probtest-incremental')
+    result.assert_outcomes(failed=1)
+    pytester.makepyfile(lib="def f():\n    return 1\n")
+    result = pytester.runpytest('--probtest','--p','0.2,0.8','--probtest-incremental')
+    result.assert_outcomes(passed=1)
+
+############## Testing aggregated reporting ##############
+def test_aggregate_summarises_repeats(pytester):
+    pytester.makepyfile(
+        """
+        runs = []
+
+        def test_f():
+            pass
+
+        def test_g():
+            runs.append(1)
+            assert len(runs)<3
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-aggregate')
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines([
+        'test * repeats * failed in * total * min * median * max',
+        '*::test_f * 29 * - *s *s *s *s',
+        '*::test_g * 3 * 2 *s *s *s *s',
+    ])
+
+def test_aggregate_progress_is_throttled(pytester, monkeypatch):
+    import probtest_aggregate
+    monkeypatch.setattr(probtest_aggregate, 'PROGRESS_INTERVAL', 0)
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-aggregate')
+    result.stdout.fnmatch_lines(['*::test_f: 1 of 6 repeats run', '*::test_f: 6 of 6 repeats run'])
+
+    monkeypatch.setattr(probtest_aggregate, 'PROGRESS_INTERVAL', 60)
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-aggregate')
+    result.stdout.no_fnmatch_line('*repeats run')
+
+############## Testing the profile ##############
+def test_profile_json(pytester):
+    pytester.makepyfile(
+        """
+        import time
+
+        def test_f():
+            data = bytearray(10**6)
+
+        def test_g():
+            time.sleep(0.01)
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-profile')
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines([
+        'Profile written to *profile.json',
+        'slowest tests * repeats * total * setup * call * teardown * cpu * peak memory',
+        '*::test_g * 6 *',
+        '*::test_f * 6 *',
+    ])
+    profile = json.loads((pytester.path / ".pytest_cache/d/probtest/profile.json").read_text())
+    f = profile["tests"]["test_profile_json.py::test_f"]
+    assert set(f)=={"setup", "call", "teardown"}
+    assert f["call"]["repeat"]==[0, 1, 2, 3, 4, 5]
+    assert all(peak >= 10**6 for peak in f["call"]["peak"])
+    assert all(wall >= 0.01 for wall in profile["tests"]["test_profile_json.py::test_g"]["call"]["wall"])
+
+def test_profile_npz(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','0.5,0.5','--probtest-single-item',
+                                           '--probtest-profile-path','profile.npz')
+    result.assert_outcomes(passed=1)
+    import numpy
+    profile = numpy.load(pytester.path / "profile.npz")
+    assert list(profile["test_profile_npz.py::test_f/call/repeat"])==[0, 1, 2, 3, 4, 5]
+    assert profile["test_profile_npz.py::test_f/setup/cpu"].dtype==numpy.float64
+
+def test_profile_does_not_take_test_file(pytester):
+    test_file = pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+    source = test_file.read_text()
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-profile',str(test_file))
+    result.assert_outcomes(passed=1)
+    assert test_file.read_text()==source
+
+def test_profile_path_refuses_python_file(pytester):
+    test_file = pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+    source = test_file.read_text()
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-profile-path',str(test_file))
+    result.stderr.fnmatch_lines(['*--probtest-profile-path: refusing to write the profile over the Python file *'])
+    assert test_file.read_text()==source
+
+def test_cprofile_merges_repeats(pytester):
+    pytester.makepyfile(
+        """
+        runs = []
+
+        def rare():
+            pass
+
+        def test_f():
+            runs.append(1)
+            if len(runs)%3==0:
+                rare()
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-cprofile','profiles')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['Profiles written to profiles', '*::test_f:', '*function * calls * own time * cumulative'])
+
+    import pstats
+    stats = pstats.Stats(str(pytester.path / "profiles" / "test_cprofile_merges_repeats.py_test_f.prof")).stats
+    calls = {function[2]: entry[1] for function, entry in stats.items()}
+    assert calls["test_f"]==6
+    assert calls["rare"]==2
+
+def test_cprofile_select(pytester):
+    pytester.makepyfile(
+        """
+        def test_insert():
+            pass
+
+        def test_delete():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-cprofile','profiles',
+                                '--probtest-cprofile-select','insert')
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(['*::test_insert:'])
+    result.stdout.no_fnmatch_line('*::test_delete:')
+    assert [path.name for path in (pytester.path / "profiles").iterdir()]==["test_cprofile_select.py_test_insert.prof"]
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-cprofile','profiles',
+                                '--probtest-cprofile-select','insert and')
+    result.stderr.fnmatch_lines(['*--probtest-cprofile-select: *'])
+
+def test_cprofile_warns_about_unprofiled_repeats(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.probtest_thread_safe
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-cprofile','profiles',
+                                '--probtest-threads','2')
+    result.assert_outcomes(passed=1, warnings=1)
+    result.stdout.fnmatch_lines(['*--probtest-cprofile does not profile repeats run concurrently',
+                                 'No tests were profiled'])
+    result.stdout.no_fnmatch_line('Profiles written to *')
+    assert not (pytester.path / "profiles").exists()
+
+    result = pytester.runpytest('--probtest','--p','0.5,0.5','--probtest-cprofile','profiles',
+                                '--probtest-workers','2')
+    result.assert_outcomes(passed=1, warnings=1)
+    result.stdout.fnmatch_lines(['*--probtest-cprofile does not profile the repeats run by '
+                                 '--probtest-workers in other processes'])
+    result.stdout.no_fnmatch_line('Profiles written to *')
+    assert not (pytester.path / "profiles").exists()
+
+############## Testing shared samples ##############
+def test_shared_sample(pytester):
+    pytester.makepyfile(
+        """
+        import random
+        import pytest
+        import probtest
+
+        draws = []
+        seen = {"f": [], "g": []}
+
+        @pytest.fixture
+        @probtest.shared_sample
+        def o():
+            draws.append(random.random())
+            return draws[-1]
+
+        def test_f(o):
+            seen["f"].append(o)
+
+        def test_g(o):
+            seen["g"].append(o)
+
+        @pytest.mark.probtest_deterministic
+        def test_draws():
+            assert len(draws)==6
+            assert seen["f"]==seen["g"]==draws
+    """)
+
+    for mode in ([], ['--probtest-single-item']):
+        result = pytester.runpytest('--probtest','--p','0.5,0.5',*mode)
+        result.assert_outcomes(passed=3)
+
+def test_shared_sample_without_probtest(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+        import probtest
+
+        @pytest.fixture
+        @probtest.shared_sample
+        def o():
+            return 1
+
+        def test_f(o):
+            assert o==1
+    """)
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1)
+
+def test_shared_sample_replay(pytester):
+    pytester.makepyfile(
+        """
+        import random
+        import pytest
+        import probtest
+
+        @pytest.fixture
+        @probtest.shared_sample
+        def o():
+            return random.randint(1, 6)
+
+        def test_a(o):
+            pass
+
+        def test_b(o):
+            assert o!=6
+    """)
+
+    args = ('--probtest','--p','0.01,0.99','--probtest-seed','3')
+    result = pytester.runpytest(*args)
+    result.assert_outcomes(passed=1, failed=1)
+    # The sample is drawn for the index of the repeat, not its seed.
+    failed_seeds = pytester.path / ".pytest_cache" / "v" / "probtest" / "failed_seeds"
+    assert json.loads(failed_seeds.read_text())=={}
+    replay = [line for line in result.outlines if "--probtest-replay" in line][0]
+    nodeid = replay[replay.index("--probtest-replay '")+len("--probtest-replay '"):-1]
+    assert nodeid.startswith("test_shared_sample_replay.py::test_b@")
+
+    result = pytester.runpytest(*args, '--probtest-replay', nodeid)
+    result.assert_outcomes(failed=1)
+
+def test_shared_sample_rejects_workers(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+        import probtest
+
+        @pytest.fixture
+        @probtest.shared_sample
+        def o():
+            return 1
+
+        def test_f(o):
+            pass
+    """)
+
+    for mode in (['--probtest-workers','2'], ['--probtest-fork']):
+        result = pytester.runpytest('--probtest','--p','0.5,0.5',*mode)
+        result.stderr.fnmatch_lines(['*test_f: the shared samples o cannot be shared by repeats run with *'])
+
+############## Testing forked repeats ##############
+def test_fork_isolates_repeats(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import os
+        import pytest
+
+        state = []
+
+        @pytest.fixture(scope="session")
+        def s():
+            with open({str(log)!r}, "a") as f:
+                f.write("setup\\n")
+            return []
+
+        def test_f(s):
+            assert state==[] and s==[]
+            state.append(1)
+            s.append(1)
+            with open({str(log)!r}, "a") as f:
+                f.write(str(os.getpid())+"\\n")
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-fork')
+    result.assert_outcomes(passed=1)
+    lines = log.read_text().split()
+    assert lines.count("setup")==1
+    pids = [line for line in lines if line!="setup"]
+    assert len(set(pids))==29
+    assert str(os.getpid()) not in pids
+
+def test_fork_reports_failing_repeat(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        def test_f():
+            with open({str(log)!r}, "a") as f:
+                f.write("run\\n")
+            with open({str(log)!r}) as f:
+                assert len(f.read().split())<3
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-fork')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['Failed in repeat 2 of 29'])
+    assert len(log.read_text().split())==3
+
+def test_fork_batches_repeats(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        import os
+
+        def test_f():
+            with open({str(log)!r}, "a") as f:
+                f.write(str(os.getpid())+"\\n")
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-fork','10')
+    result.assert_outcomes(passed=1)
+    pids = log.read_text().split()
+    assert len(pids)==29
+    assert len(set(pids))==3
+
+def test_fork_reports_crashed_child(pytester):
+    pytester.makepyfile(
+        """
+        import os
+
+        def test_f():
+            os._exit(3)
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-fork')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['*child process running repeats 0 to 0 exited with code 3*',
+                                 'Failed in repeat 0 of 29'])
+
+############## Testing sequential probability ratio tests ##############
+def test_sprt_stops_passing_test(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makepyfile(
+        f"""
+        def test_f():
+            with open({str(log)!r}, "a") as f:
+                f.write("run\\n")
+    """)
+
+    result = pytester.runpytest('--probtest','--probtest-sprt','0,0.1,0.05,0.05','-v')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['SPRT of P(bug) <= 0.0 against P(bug) >= 0.1 *expected 28.0 repeats if P(bug) = 0.0*',
+                                 '*SPRT accepted P(bug) <= 0.0 after 28 repeats with 0 failing*'])
+    assert len(log.read_text().split())==28
+
+def test_sprt_tolerates_rare_failures(pytester):
+    pytester.makepyfile(
+        """
+        import random
+
+        def test_f():
+            assert random.random() > 0.02
+    """)
+
+    result = pytester.runpytest('--probtest','--probtest-sprt','0.05,0.5,0.05,0.05',
+                                '--probtest-seed','1','-v')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['*SPRT accepted P(bug) <= 0.05 after *'])
+
+def test_sprt_fails_buggy_test(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            assert False
+    """)
+
+    result = pytester.runpytest('--probtest','--probtest-sprt','0.05,0.5,0.05,0.05')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['SPRT accepted P(bug) >= 0.5 after 2 repeats with 2 failing',
+                                 'Failed in repeat 1 of *'])
+
+def test_sprt_runs_single_repeat_tests_once(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        runs = {"deterministic": 0, "certain": 0}
+
+        @pytest.mark.probtest_deterministic
+        def test_deterministic():
+            runs["deterministic"] += 1
+
+        @pytest.mark.probtest(p="1")
+        def test_certain():
+            runs["certain"] += 1
+
+        @pytest.mark.probtest_deterministic
+        def test_runs():
+            assert runs=={"deterministic": 1, "certain": 1}
+    """)
+
+    result = pytester.runpytest('--probtest','--probtest-sprt','0,0.1,0.05,0.05')
+    result.assert_outcomes(passed=3)
+
+def test_sprt_invalid_parameters(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--probtest-sprt','0.5,0.1,0.05,0.05')
+    result.stdout.fnmatch_lines(['*The bug probabilities must satisfy 0 <= p0 < p1 < 1.*'])
+
+############## Testing the global epsilon ##############
+def test_global_epsilon_split_by_cost(pytester):
+    pytester.makepyfile(
+        """
+        import time
+
+        def test_slow():
+            time.sleep(0.005)
+
+        def test_fast():
+            pass
+    """)
+
+    args = ('--probtest','--p','0.1,0.9','--probtest-global-epsilon','0.05')
+    result = pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(['Your tests are being run a number of times given per test*',
+                                 'test_*::test_slow * - * 0.025 * 36',
+                                 'test_*::test_fast * - * 0.025 * 36'])
+
+    result = pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+    costs = pytester.path / ".pytest_cache" / "v" / "probtest" / "costs"
+    assert len(json.loads(costs.read_text()))==2
+    lines = [line.split() for line in result.stdout.lines if line.startswith("test_") and "::" in line]
+    epsilons = {line[0].split("::")[1]: float(line[2]) for line in lines}
+    assert epsilons["test_slow"] > epsilons["test_fast"]
+    assert sum(epsilons.values()) <= 0.05
+
+def test_global_epsilon_split_over_selected_tests(pytester):
+    pytester.makepyfile(
+        """
+        def test_a():
+            pass
+
+        def test_b():
+            pass
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','0.1,0.9','--probtest-global-epsilon','0.05',
+                                           '-k','test_a')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['test_*::test_a * - * 0.05 * 29'])
+    result.stdout.no_fnmatch_line('*::test_b *')
+
+def test_global_epsilon_header(pytester):
+    pytester.makepyfile(
+        """
+        def test_f():
+            pass
+    """)
+
+    result = pytester.runpytest_subprocess('--probtest','--p','0.1,0.9','--probtest-global-epsilon','0.01')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['Global epsilon: 0.01, split over the tests by the cost of their repeats'])
+    result.stdout.no_fnmatch_line('Epsilon: *')
+
+def test_global_epsilon_keeps_certifications(pytester):
+    pytester.makepyfile(
+        """
+        def test_a():
+            pass
+
+        def test_b():
+            pass
+    """)
+
+    args = ('--probtest','--p','0.1,0.9','--probtest-global-epsilon','0.05','--probtest-incremental')
+    costs = pytester.path / ".pytest_cache" / "v" / "probtest" / "costs"
+    costs.parent.mkdir(parents=True)
+    costs.write_text(json.dumps({"test_global_epsilon_keeps_certifications.py::test_a": 0.001,
+                                 "test_global_epsilon_keeps_certifications.py::test_b": 0.001}))
+    pytester.runpytest_subprocess(*args).assert_outcomes(passed=2)
+
+    # Noise in the measured costs does not change k.
+    costs.write_text(json.dumps({"test_global_epsilon_keeps_certifications.py::test_a": 0.0012,
+                                 "test_global_epsilon_keeps_certifications.py::test_b": 0.0009}))
+    pytester.runpytest_subprocess(*args).assert_outcomes(skipped=2)
+
+    # A test whose k falls stays certified, and one whose k rises runs the
+    # repeats it lacks.
+    costs.write_text(json.dumps({"test_global_epsilon_keeps_certifications.py::test_a": 0.1,
+                                 "test_global_epsilon_keeps_certifications.py::test_b": 0.001}))
+    result = pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=1, skipped=1)
+
+def test_global_epsilon_used_up_by_markers(pytester):
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.probtest(Pbug=0.1, epsilon=0.05)
+        def test_f():
+            pass
+
+        def test_g():
+            pass
+    """)
+
+    result = pytester.runpytest('--probtest','--p','0.1,0.9','--probtest-global-epsilon','0.05')
+    result.stderr.fnmatch_lines(['*--probtest-global-epsilon is used up by the epsilons of probtest markers*'])